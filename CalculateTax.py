@@ -1,15 +1,15 @@
 #!/usr/bin/python3
 
 import argparse
+import array
 import datetime
+import hashlib
 import json
 import locale
 import logging
 
 from defaults import DEFAULT_DATA, TAX_DATA_FILE_NAME
 
-locale.setlocale(locale.LC_ALL, '')
-
 
 def _validate_year(value):
     """
@@ -50,6 +50,181 @@ def _validate_salary(value):
     return ivalue
 
 
+def _get_year_tax_data(year, tax_data):
+    """
+    Looking up the tax data of a single year, raising a user friendly error
+    if the year is not available
+    """
+    try:
+        return tax_data[year]
+    except KeyError:
+        raise ValueError(
+            "Data for year %s is not available, please run command with "
+            "-h to see available options or try a different year. Data is "
+            "available for the following years: %s" %
+            (year, ', '.join([_year for _year in tax_data]))
+        )
+
+
+class CurrencyFormat:
+    """
+    Explicit currency formatting configuration.
+
+    Formatting with it only reads its own attributes, unlike locale.currency
+    which depends on the process wide locale, so one instance can be shared
+    between threads and different requests can use different formats.
+    Amounts are laid out like locale.currency(amount, grouping=True) does
+    for a locale with the same monetary settings.
+
+    init params:
+        symbol:         currency symbol
+        thousands_sep:  separator between groups of digits
+        decimal_point:  separator between the units and the fraction
+        frac_digits:    number of digits after the decimal point
+        grouping:       sizes of the groups of digits from the right, like
+                        localeconv()['mon_grouping'], 0 repeating the last
+                        size
+        cs_precedes:    symbol put in front of the amount, else after it
+        sep_by_space:   symbol separated from the amount by a space
+        sign_posn:      position of the sign, like localeconv()['p_sign_posn']
+        positive_sign:  sign of positive amounts
+        negative_sign:  sign of negative amounts
+        n_cs_precedes, n_sep_by_space, n_sign_posn: the same settings for
+                        negative amounts, defaulting to the positive ones
+    """
+    def __init__(self, symbol='\u00a3', thousands_sep=',', decimal_point='.',
+                 frac_digits=2, grouping=(3, 0), cs_precedes=True,
+                 sep_by_space=False, sign_posn=1, positive_sign='',
+                 negative_sign='-', n_cs_precedes=None, n_sep_by_space=None,
+                 n_sign_posn=None):
+        self.symbol = symbol
+        self.thousands_sep = thousands_sep
+        self.decimal_point = decimal_point
+        self.frac_digits = frac_digits
+        self.grouping = tuple(grouping)
+        self.cs_precedes = cs_precedes
+        self.sep_by_space = sep_by_space
+        self.sign_posn = sign_posn
+        self.positive_sign = positive_sign
+        self.negative_sign = negative_sign
+        self.n_cs_precedes = (
+            cs_precedes if n_cs_precedes is None else n_cs_precedes
+        )
+        self.n_sep_by_space = (
+            sep_by_space if n_sep_by_space is None else n_sep_by_space
+        )
+        self.n_sign_posn = sign_posn if n_sign_posn is None else n_sign_posn
+
+    @classmethod
+    def from_localeconv(cls, conv):
+        """
+        Build a format out of a locale.localeconv() dict, read once by the
+        caller after setting up its locale
+        """
+        return cls(
+            symbol=conv['currency_symbol'],
+            thousands_sep=conv['mon_thousands_sep'],
+            decimal_point=conv['mon_decimal_point'],
+            frac_digits=conv['frac_digits'],
+            grouping=conv['mon_grouping'],
+            cs_precedes=bool(conv['p_cs_precedes']),
+            sep_by_space=bool(conv['p_sep_by_space']),
+            sign_posn=conv['p_sign_posn'],
+            positive_sign=conv['positive_sign'],
+            negative_sign=conv['negative_sign'],
+            n_cs_precedes=bool(conv['n_cs_precedes']),
+            n_sep_by_space=bool(conv['n_sep_by_space']),
+            n_sign_posn=conv['n_sign_posn'],
+        )
+
+    def _group_sizes(self):
+        last_size = None
+        for size in self.grouping:
+            if size == locale.CHAR_MAX:
+                return
+            if size == 0:
+                while last_size is not None:
+                    yield last_size
+                return
+            yield size
+            last_size = size
+
+    def _group(self, digits):
+        groups = []
+        for size in self._group_sizes():
+            if len(digits) <= size:
+                break
+            groups.append(digits[-size:])
+            digits = digits[:-size]
+        groups.append(digits)
+        return self.thousands_sep.join(reversed(groups))
+
+    def format(self, amount):
+        if amount < 0:
+            cs_precedes, sep_by_space, sign_posn, sign = (
+                self.n_cs_precedes, self.n_sep_by_space, self.n_sign_posn,
+                self.negative_sign
+            )
+        else:
+            cs_precedes, sep_by_space, sign_posn, sign = (
+                self.cs_precedes, self.sep_by_space, self.sign_posn,
+                self.positive_sign
+            )
+
+        units, _, fraction = '{:.{}f}'.format(
+            abs(amount), self.frac_digits
+        ).partition('.')
+        value = self._group(units)
+        if fraction:
+            value += self.decimal_point + fraction
+
+        # Positions 3 and 4 put the sign right next to the number
+        if sign_posn == 3:
+            value = sign + value
+        elif sign_posn == 4:
+            value += sign
+
+        space = ' ' if sep_by_space else ''
+        if cs_precedes:
+            value = self.symbol + space + value
+        else:
+            value = value + space + self.symbol
+
+        if sign_posn == 0:
+            return '(' + value + ')'
+        if sign_posn == 2:
+            return value + sign
+        if sign_posn in (3, 4):
+            return value
+        return sign + value
+
+
+GBP = CurrencyFormat()
+
+
+def _get_locale_currency_format():
+    """
+    Currency format of the current locale, read by the command line once
+    after setting up the locale. Falls back to GBP when the locale has no
+    currency, like the default C locale.
+    """
+    conv = locale.localeconv()
+    if not conv['currency_symbol'] or conv['frac_digits'] == locale.CHAR_MAX:
+        return GBP
+    return CurrencyFormat.from_localeconv(conv)
+
+
+def _get_band_label(band):
+    """
+    Label template of a band, bands unknown to IncomeTaxYearData are named
+    after their key
+    """
+    try:
+        return IncomeTaxYearData.BANDS[band]
+    except KeyError:
+        return band.replace('_', ' ').title() + ': {amount} @ {rate}%'
+
+
 class IncomeTaxYearData:
     """
     Object containing tax data and calculated variables based on gross salary,
@@ -60,6 +235,8 @@ class IncomeTaxYearData:
         gross_salary: salary used to calculate variable portions of tax
                       deductions like personal allowance and tax deductions
                       per band.
+        currency_format: CurrencyFormat used for the labels, defaults to
+                      GBP
     """
     PERSONAL_ALLOWANCE = 'personal_allowance'
 
@@ -86,7 +263,8 @@ class IncomeTaxYearData:
             'Top Rate: {amount} @ {rate}%',
     }
 
-    def __init__(self, year=None, tax_data=None, gross_salary=None):
+    def __init__(self, year=None, tax_data=None, gross_salary=None,
+                 currency_format=None):
         if year is None:
             raise ValueError("year can't be null")
 
@@ -102,15 +280,7 @@ class IncomeTaxYearData:
         if isinstance(tax_data, str):
             tax_data = json.loads(tax_data)
 
-        try:
-            year_tax_data = tax_data[year]
-        except KeyError:
-            raise ValueError(
-                "Data for year %s is not available, please run command with "
-                "-h to see available options or try a different year. Data is "
-                "available for the following years: %s" %
-                (year, ', '.join([_year for _year in tax_data]))
-            )
+        year_tax_data = _get_year_tax_data(year, tax_data)
 
         try:
             self.personal_allowance = year_tax_data['personal_allowance']
@@ -121,6 +291,9 @@ class IncomeTaxYearData:
 
         self.tax_data = tax_data
         self.year = year
+        if currency_format is None:
+            currency_format = GBP
+        self.currency_format = currency_format
         self.gross_salary = gross_salary
         self.taxable_income = self.gross_salary - self.personal_allowance
 
@@ -158,24 +331,25 @@ class IncomeTaxYearData:
         with open(TAX_DATA_FILE_NAME, 'w') as outfile:
             json.dump(DEFAULT_DATA, outfile)
 
+    def _format_currency(self, amount):
+        return self.currency_format.format(amount)
+
     def get_gross_salary_label(self):
         logging.debug('Getting Formated Gross Salary')
         return self.GROSS_SALARY_LABEL.format(
-            gross_salary=locale.currency(self.gross_salary, grouping=True)
+            gross_salary=self._format_currency(self.gross_salary)
         ) + '\n'
 
     def get_personal_allowance_label(self):
         logging.debug('Getting Formated Personal Allowance')
         return self.PERSONAL_ALLOWANCE_LABEL.format(
-            personal_allowance=locale.currency(
-                self.personal_allowance, grouping=True
-            )
+            personal_allowance=self._format_currency(self.personal_allowance)
         ) + '\n'
 
     def get_taxable_income_label(self):
         logging.debug('Getting Formated Taxable Income')
         return self.TAXABLE_INCOME_LABEL.format(
-            taxable_income=locale.currency(self.taxable_income, grouping=True)
+            taxable_income=self._format_currency(self.taxable_income)
         ) + '\n'
 
     def get_band_label(self, rate):
@@ -186,13 +360,10 @@ class IncomeTaxYearData:
 
         if tax_band_obj.band_deduction:
             return self.BANDS.get(rate).format(
-                amount=locale.currency(
-                    tax_band_obj.range_amount, grouping=True
-                ),
+                amount=self._format_currency(tax_band_obj.range_amount),
                 rate=str(tax_band_obj.rate)
-            ) + ' = ' + locale.currency(
-                tax_band_obj.band_deduction,
-                grouping=True
+            ) + ' = ' + self._format_currency(
+                tax_band_obj.band_deduction
             ) + '\n'
 
         return None
@@ -205,7 +376,7 @@ class IncomeTaxYearData:
 
         return (
             'Total Tax Due: ' +
-            locale.currency(total_tax, grouping=True) + '\n'
+            self._format_currency(total_tax) + '\n'
         )
 
     def get_breakdown(self):
@@ -309,6 +480,273 @@ class TaxBand:
         }
 
 
+class TaxSchedule:
+    """
+    Compiled, read only form of the tax data for a year.
+
+    The bands are flattened, in IncomeTaxYearData.BANDS order, into a tuple of
+    (name, rate, width) entries where width is the amount of taxable income
+    covered by the band, or None for a band with no upper limit.
+
+    The personal allowance can be tapered away for high salaries, losing 1
+    for every taper_ratio of gross salary above taper_threshold.
+
+    init params:
+        personal_allowance: tax free amount subtracted from the gross salary
+        bands:              sequence of (name, rate, width) entries
+        taper_threshold:    gross salary above which the personal allowance
+                            is reduced, None for no taper
+        taper_ratio:        gross salary over the threshold taking 1 off the
+                            personal allowance
+    """
+    def __init__(self, personal_allowance=None, bands=None,
+                 taper_threshold=None, taper_ratio=2):
+        if personal_allowance is None:
+            raise ValueError("personal_allowance can't be null")
+
+        if bands is None:
+            raise ValueError("bands can't be null")
+
+        if taper_threshold is not None and not taper_ratio > 0:
+            raise ValueError("taper_ratio must be a positive number")
+
+        self.personal_allowance = personal_allowance
+        self.taper_threshold = taper_threshold
+        self.taper_ratio = taper_ratio
+        self.bands = tuple(
+            (name, rate, width) for name, rate, width in bands
+        )
+        self.band_names = tuple(band[0] for band in self.bands)
+
+    def fingerprint(self):
+        """Hash of everything the calculation depends on"""
+        return hashlib.sha256(json.dumps([
+            self.personal_allowance,
+            self.bands,
+            self.taper_threshold,
+            self.taper_ratio,
+        ]).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_year_data(cls, year_tax_data=None):
+        """Compile the tax data of a year as found in the JSON file"""
+        if year_tax_data is None:
+            raise ValueError("year_tax_data can't be null")
+
+        try:
+            personal_allowance = year_tax_data['personal_allowance']
+        except KeyError:
+            msg = ('Personal Allowance data is missing, '
+                   'run command with -h to see available options.')
+            raise ValueError(msg)
+
+        bands = []
+        for band in IncomeTaxYearData.BANDS:
+            if year_tax_data.get(band) and year_tax_data[band] is not None:
+                range_start = year_tax_data[band]['range_start']
+                range_end = year_tax_data[band]['range_end']
+                # Same as in TaxBand, a band without an end is "infinite"
+                if range_end:
+                    width = range_end - range_start
+                else:
+                    width = None
+                bands.append((band, year_tax_data[band]['rate'], width))
+
+        return cls(personal_allowance=personal_allowance, bands=bands)
+
+    @classmethod
+    def from_tax_data(cls, year=None, tax_data=None):
+        """Compile the tax data of a year out of all available tax data"""
+        if year is None:
+            raise ValueError("year can't be null")
+
+        if tax_data is None:
+            raise ValueError("year_tax_data can't be null")
+
+        if isinstance(year, int):
+            year = str(year)
+
+        if isinstance(tax_data, str):
+            tax_data = json.loads(tax_data)
+
+        return cls.from_year_data(_get_year_tax_data(year, tax_data))
+
+
+class TaxCalculator:
+    """
+    Reusable calculator for a single year, meant for callers computing the
+    tax of many salaries in a tight loop.
+
+    Unlike IncomeTaxYearData no dicts or TaxBand objects are built per
+    salary, results are written into the preallocated `result` array laid
+    out as:
+
+        [taxable_income, total_tax,
+         band amounts (one per band), band deductions (one per band)]
+
+    The buffer is overwritten on every call, so compute() and compute_into()
+    must not be used on a calculator shared between threads. calculate() and
+    get_breakdown() only read the compiled schedule and are safe to call
+    concurrently on a shared calculator.
+
+    init params:
+        year_data: tax data of a year as found in the JSON file, or an
+                   already compiled TaxSchedule
+    """
+    TAXABLE_INCOME = 0
+    TOTAL_TAX = 1
+    BAND_AMOUNTS = 2
+
+    def __init__(self, year_data=None):
+        if year_data is None:
+            raise ValueError("year_data can't be null")
+
+        if isinstance(year_data, TaxSchedule):
+            self.schedule = year_data
+        else:
+            self.schedule = TaxSchedule.from_year_data(year_data)
+
+        self.band_count = len(self.schedule.bands)
+        self.record_size = self.BAND_AMOUNTS + 2 * self.band_count
+        self.result = array.array('d', bytes(8 * self.record_size))
+
+        self._personal_allowance = self.schedule.personal_allowance
+        self._taper_threshold = self.schedule.taper_threshold
+        self._taper_ratio = self.schedule.taper_ratio
+        self._band_rates = tuple(
+            (rate, width) for _name, rate, width in self.schedule.bands
+        )
+
+    def _fill(self, gross_salary, out, offset=0):
+        """
+        Write the result record for gross_salary into out at offset and
+        return the total tax due. Mirrors the calculation in TaxBand.
+        """
+        personal_allowance = self._personal_allowance
+        if (self._taper_threshold is not None and
+                gross_salary > self._taper_threshold):
+            personal_allowance -= (
+                (gross_salary - self._taper_threshold) // self._taper_ratio
+            )
+            if personal_allowance < 0:
+                personal_allowance = 0
+
+        taxable_income = gross_salary - personal_allowance
+        out[offset + self.TAXABLE_INCOME] = taxable_income
+
+        total_tax = 0
+        amount_index = offset + self.BAND_AMOUNTS
+        deduction_index = amount_index + self.band_count
+        for rate, width in self._band_rates:
+            # We still have money to be taxed above this band
+            if width is not None and taxable_income > width:
+                salary_part = width
+                taxable_income -= width
+            # There isn't any more money to be taxed in higher bands
+            else:
+                salary_part = taxable_income
+                taxable_income = 0
+            tax_deduction = (rate * salary_part) / 100.0
+            out[amount_index] = salary_part
+            out[deduction_index] = tax_deduction
+            total_tax += tax_deduction
+            amount_index += 1
+            deduction_index += 1
+
+        out[offset + self.TOTAL_TAX] = total_tax
+        return total_tax
+
+    def compute(self, gross_salary):
+        """Calculate the tax for gross_salary into the result buffer"""
+        self._fill(gross_salary, self.result)
+        return self.result
+
+    def compute_into(self, salaries, out_array):
+        """
+        Calculate the total tax due for each of salaries into the
+        preallocated out_array, which must be at least as long as salaries
+        """
+        fill = self._fill
+        result = self.result
+        index = 0
+        for gross_salary in salaries:
+            out_array[index] = fill(gross_salary, result)
+            index += 1
+        return out_array
+
+    def calculate(self, gross_salary):
+        """
+        Calculate the tax for gross_salary into a new result array, leaving
+        the shared result buffer untouched
+        """
+        result = array.array('d', bytes(8 * self.record_size))
+        self._fill(gross_salary, result)
+        return result
+
+    def get_breakdown(self, gross_salary, currency_format=GBP):
+        """
+        Same text as IncomeTaxYearData.get_breakdown, formatted with an
+        explicit currency_format instead of the process locale
+        """
+        result = self.calculate(gross_salary)
+        fmt = currency_format.format
+
+        message = ''
+        if gross_salary:
+            message += IncomeTaxYearData.GROSS_SALARY_LABEL.format(
+                gross_salary=fmt(gross_salary)
+            ) + '\n\n'
+
+        message += IncomeTaxYearData.PERSONAL_ALLOWANCE_LABEL.format(
+            personal_allowance=fmt(
+                gross_salary - result[self.TAXABLE_INCOME]
+            )
+        ) + '\n\n'
+
+        if gross_salary:
+            message += IncomeTaxYearData.TAXABLE_INCOME_LABEL.format(
+                taxable_income=fmt(result[self.TAXABLE_INCOME])
+            ) + '\n\n'
+
+        amount_index = self.BAND_AMOUNTS
+        for name, rate, _width in self.schedule.bands:
+            band_deduction = result[amount_index + self.band_count]
+            if band_deduction:
+                message += _get_band_label(name).format(
+                    amount=fmt(result[amount_index]),
+                    rate=str(rate)
+                ) + ' = ' + fmt(band_deduction) + '\n'
+            amount_index += 1
+
+        if gross_salary:
+            message += (
+                '\nTotal Tax Due: ' + fmt(result[self.TOTAL_TAX]) + '\n'
+            )
+
+        return message
+
+    @property
+    def taxable_income(self):
+        return self.result[self.TAXABLE_INCOME]
+
+    @property
+    def total_tax(self):
+        return self.result[self.TOTAL_TAX]
+
+    def band_amount(self, band):
+        """Salary part of the last computed salary falling in band"""
+        return self.result[
+            self.BAND_AMOUNTS + self.schedule.band_names.index(band)
+        ]
+
+    def band_deduction(self, band):
+        """Tax due on the last computed salary for band"""
+        return self.result[
+            self.BAND_AMOUNTS + self.band_count +
+            self.schedule.band_names.index(band)
+        ]
+
+
 def main():
     """
     Main function thread setting up the argument parsing and directing the flow
@@ -354,6 +792,10 @@ def main():
 
     args = parser.parse_args()
 
+    # Labels are formatted with the currency of the user's locale
+    locale.setlocale(locale.LC_ALL, '')
+    currency_format = _get_locale_currency_format()
+
     # Reset the Income Tax Data to Default
     if args.reset:
         IncomeTaxYearData._reset_tax_data()
@@ -380,7 +822,7 @@ def main():
 
     try:
         tax_data = IncomeTaxYearData(
-            args.tax_year, tax_data, args.gross_income
+            args.tax_year, tax_data, args.gross_income, currency_format
         )
     except KeyError:
         logging.error("Tax Data for year %s is not available, "
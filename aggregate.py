@@ -0,0 +1,296 @@
+import logging
+import math
+import multiprocessing
+
+from CalculateTax import TaxCalculator, TaxSchedule
+from batch import read_records
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a bounded relative error.
+
+    Values are counted in logarithmically sized buckets, so the memory used
+    only grows with the log of the value range and two sketches with the
+    same accuracy are merged by adding their bucket counts.
+
+    init params:
+        relative_accuracy: relative error allowed on the returned quantiles
+    """
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value):
+        if value > 0:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < 0:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the counts of other, a sketch with the same accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches of different accuracy")
+
+        for buckets, other_buckets in ((self.positive, other.positive),
+                                       (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.count:
+            if self.min is None or other.min < self.min:
+                self.min = other.min
+            if self.max is None or other.max > self.max:
+                self.max = other.max
+        return self
+
+    def quantile(self, q):
+        """Estimated value below which a fraction q of the values fall"""
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+
+        if not self.count:
+            return None
+
+        # The extremes are tracked exactly
+        if q == 0:
+            return self.min
+        if q == 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self._value(index), self.min)
+
+        seen += self.zero_count
+        if seen > rank:
+            return 0
+
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+
+class YearAggregate:
+    """
+    Running totals of the tax of a population for one year, with quantile
+    sketches of the total tax and of the tax due per band.
+
+    init params:
+        band_names:        names of the bands of the year, in schedule order
+        relative_accuracy: relative error of the quantile sketches
+    """
+    def __init__(self, band_names=None,
+                 relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if band_names is None:
+            raise ValueError("band_names can't be null")
+
+        self.band_names = tuple(band_names)
+        self.count = 0
+        self.gross_salary = 0
+        self.taxable_income = 0
+        self.total_tax = 0
+        self.effective_rate_sum = 0
+        self.effective_rate_count = 0
+        self.band_amounts = dict.fromkeys(self.band_names, 0)
+        self.band_deductions = dict.fromkeys(self.band_names, 0)
+        self.tax_sketch = QuantileSketch(relative_accuracy)
+        self.band_sketches = {
+            band: QuantileSketch(relative_accuracy)
+            for band in self.band_names
+        }
+
+    def add(self, gross_salary, result):
+        """Add one salary, with result laid out like TaxCalculator.result"""
+        total_tax = result[TaxCalculator.TOTAL_TAX]
+        self.count += 1
+        self.gross_salary += gross_salary
+        self.taxable_income += result[TaxCalculator.TAXABLE_INCOME]
+        self.total_tax += total_tax
+        self.tax_sketch.add(total_tax)
+        if gross_salary > 0:
+            self.effective_rate_sum += total_tax / gross_salary
+            self.effective_rate_count += 1
+
+        amount_index = TaxCalculator.BAND_AMOUNTS
+        deduction_index = amount_index + len(self.band_names)
+        for band in self.band_names:
+            self.band_amounts[band] += result[amount_index]
+            self.band_deductions[band] += result[deduction_index]
+            self.band_sketches[band].add(result[deduction_index])
+            amount_index += 1
+            deduction_index += 1
+
+    def merge(self, other):
+        """Add the totals of other, an aggregate of the same year"""
+        if other.band_names != self.band_names:
+            raise ValueError("Can't merge aggregates of different bands")
+
+        self.count += other.count
+        self.gross_salary += other.gross_salary
+        self.taxable_income += other.taxable_income
+        self.total_tax += other.total_tax
+        self.effective_rate_sum += other.effective_rate_sum
+        self.effective_rate_count += other.effective_rate_count
+        self.tax_sketch.merge(other.tax_sketch)
+        for band in self.band_names:
+            self.band_amounts[band] += other.band_amounts[band]
+            self.band_deductions[band] += other.band_deductions[band]
+            self.band_sketches[band].merge(other.band_sketches[band])
+        return self
+
+    @property
+    def mean_effective_rate(self):
+        if not self.effective_rate_count:
+            return None
+        return self.effective_rate_sum / self.effective_rate_count
+
+    def summary(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9, 0.99)):
+        """Totals of the year as a dict of plain values"""
+        return {
+            'count': self.count,
+            'gross_salary': self.gross_salary,
+            'taxable_income': self.taxable_income,
+            'total_tax': self.total_tax,
+            'mean_effective_rate': self.mean_effective_rate,
+            'band_amounts': dict(self.band_amounts),
+            'band_deductions': dict(self.band_deductions),
+            'tax_quantiles': {
+                q: self.tax_sketch.quantile(q) for q in quantiles
+            },
+            'band_quantiles': {
+                band: {q: sketch.quantile(q) for q in quantiles}
+                for band, sketch in self.band_sketches.items()
+            },
+        }
+
+
+class PopulationAggregate:
+    """
+    Streaming aggregation of batch records into one YearAggregate per year.
+    Only running totals and sketches are kept, never per employee results,
+    and partial aggregates of shards of a population can be merged.
+
+    init params:
+        tax_data:          all available tax data
+        relative_accuracy: relative error of the quantile sketches
+    """
+    def __init__(self, tax_data=None,
+                 relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if tax_data is None:
+            raise ValueError("tax_data can't be null")
+
+        self.tax_data = tax_data
+        self.relative_accuracy = relative_accuracy
+        self.years = {}
+        self._calculators = {}
+
+    def _calculator(self, year):
+        try:
+            return self._calculators[year]
+        except KeyError:
+            calculator = TaxCalculator(
+                TaxSchedule.from_tax_data(year, self.tax_data)
+            )
+            self._calculators[year] = calculator
+            self.years.setdefault(year, YearAggregate(
+                calculator.schedule.band_names, self.relative_accuracy
+            ))
+            return calculator
+
+    def add(self, year, gross_salary):
+        year = str(year)
+        calculator = self._calculator(year)
+        self.years[year].add(gross_salary, calculator.compute(gross_salary))
+
+    def add_records(self, records):
+        """Add (employee_id, tax_year, gross_salary) records"""
+        for _employee_id, year, gross_salary in records:
+            self.add(year, gross_salary)
+        return self
+
+    def merge(self, other):
+        """
+        Add the totals of other, merged into aggregates of this population
+        so other is left untouched
+        """
+        for year, year_aggregate in other.years.items():
+            if year not in self.years:
+                self.years[year] = YearAggregate(
+                    year_aggregate.band_names, self.relative_accuracy
+                )
+            self.years[year].merge(year_aggregate)
+        return self
+
+    def __getstate__(self):
+        # Calculators are rebuilt on demand, only the totals are shipped
+        # between processes
+        state = self.__dict__.copy()
+        state['_calculators'] = {}
+        return state
+
+    def summary(self):
+        return {
+            year: year_aggregate.summary()
+            for year, year_aggregate in sorted(self.years.items())
+        }
+
+
+def _aggregate_file(args):
+    path, tax_data, relative_accuracy = args
+    logging.debug('Aggregating batch file %s', path)
+    aggregate = PopulationAggregate(tax_data, relative_accuracy)
+    return aggregate.add_records(read_records(path))
+
+
+def aggregate_files(paths, tax_data, processes=None,
+                    relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    Aggregate batch files, each one a shard of the population, in a pool of
+    processes and merge the partial aggregates
+    """
+    aggregate = PopulationAggregate(tax_data, relative_accuracy)
+    jobs = [(path, tax_data, relative_accuracy) for path in paths]
+    if processes == 1:
+        for partial in map(_aggregate_file, jobs):
+            aggregate.merge(partial)
+        return aggregate
+
+    with multiprocessing.Pool(processes) as pool:
+        for partial in pool.imap_unordered(_aggregate_file, jobs):
+            aggregate.merge(partial)
+    return aggregate
@@ -0,0 +1,192 @@
+import csv
+import json
+import logging
+import os
+
+from CalculateTax import TaxCalculator, TaxSchedule
+
+RECORD_FIELDS = ('employee_id', 'tax_year', 'gross_salary')
+RESULT_FIELDS = RECORD_FIELDS + ('taxable_income', 'total_tax')
+
+
+def _parse_amount(value):
+    """
+    Parsing an amount read from a batch file, keeping whole pounds as
+    integers like the command line does
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def read_records(path):
+    """
+    Read the records of a batch file, a CSV file with one
+    employee_id,tax_year,gross_salary row per employment and an optional
+    header, yielding (employee_id, tax_year, gross_salary) tuples
+    """
+    with open(path, newline='') as batch_file:
+        for line_number, row in enumerate(csv.reader(batch_file), 1):
+            if not row:
+                continue
+            if line_number == 1 and tuple(row) == RECORD_FIELDS:
+                continue
+            try:
+                employee_id, tax_year, gross_salary = row
+                gross_salary = _parse_amount(gross_salary)
+            except ValueError:
+                raise ValueError(
+                    "%s:%d is not a valid batch record: %s" %
+                    (path, line_number, ','.join(row))
+                )
+            yield employee_id, tax_year, gross_salary
+
+
+def write_records(path, records):
+    """Write (employee_id, tax_year, gross_salary) records to a batch file"""
+    with open(path, 'w', newline='') as batch_file:
+        writer = csv.writer(batch_file)
+        writer.writerow(RECORD_FIELDS)
+        writer.writerows(records)
+
+
+def _load_schedules(manifest_path, output_path):
+    """
+    Schedule fingerprints of the previous run, empty when either its
+    manifest or its output is missing
+    """
+    if not (os.path.exists(manifest_path) and os.path.exists(output_path)):
+        return {}
+
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)['schedules']
+
+
+def _read_previous_rows(output_path):
+    """Result rows of the previous run, in the order they were written"""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, newline='') as output_file:
+        reader = csv.reader(output_file)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield row
+
+
+def _write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w', newline='') as tmp_file:
+            write(tmp_file)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def run_batch(records, tax_data, output_path, manifest_path=None,
+              payslip_writer=None):
+    """
+    Calculate the tax of (employee_id, tax_year, gross_salary) records into
+    the CSV file output_path, one row per employee and year.
+
+    Records must be sorted by employee and year, as yielded by
+    external_sort.group_incomes, ids and years being compared as strings.
+    Rows are written as they are calculated and the previous output is
+    read alongside, so memory use doesn't grow with the number of records.
+
+    The manifest keeps a fingerprint of the schedule of every year used.
+    When both the manifest and the output of a previous run exist, only
+    records whose salary or year schedule changed are recalculated, the
+    others are copied over from the previous output, which holds the
+    salary each row was calculated from.
+    Returns the number of rows 'recomputed' and 'reused'.
+
+    With a payslips.PayslipWriter, the payslip of every record is written
+    too, straight from the calculated values. Reused records are then
+    calculated for their payslip only, their row is still copied over.
+    """
+    if manifest_path is None:
+        manifest_path = output_path + '.manifest.json'
+
+    previous_schedules = _load_schedules(manifest_path, output_path)
+    schedules = {}
+    calculators = {}
+    stats = {'recomputed': 0, 'reused': 0}
+
+    def write_output(output_file):
+        writer = csv.writer(output_file)
+        writer.writerow(RESULT_FIELDS)
+
+        previous_rows = _read_previous_rows(output_path)
+        previous_row = next(previous_rows, None)
+        last_key = None
+        for record in records:
+            employee_id, tax_year, gross_salary = record
+            # Keys are compared with the strings read back from the output
+            employee_id = str(employee_id)
+            tax_year = str(tax_year)
+            key = (employee_id, tax_year)
+            if last_key is not None and key <= last_key:
+                if key == last_key:
+                    raise ValueError(
+                        "Employee %s has more than one record for %s, "
+                        "combine them first with external_sort.group_incomes"
+                        % key
+                    )
+                raise ValueError(
+                    "Records must be sorted by employee and year, employee "
+                    "%s for %s comes after %s for %s, sort them first with "
+                    "external_sort.group_incomes" % (key + last_key)
+                )
+            last_key = key
+
+            if tax_year not in calculators:
+                schedule = TaxSchedule.from_tax_data(tax_year, tax_data)
+                calculators[tax_year] = TaxCalculator(schedule)
+                schedules[tax_year] = schedule.fingerprint()
+
+            # Both outputs are sorted, skip the previous rows of employees
+            # and years which are no longer there
+            while (previous_row is not None and
+                   tuple(previous_row[:2]) < key):
+                previous_row = next(previous_rows, None)
+
+            reused = (
+                previous_row is not None and
+                tuple(previous_row[:2]) == key and
+                previous_row[2] == str(gross_salary) and
+                previous_schedules.get(tax_year) == schedules[tax_year]
+            )
+            # Payslip writers replace their whole output, so reused records
+            # are calculated again when they need a payslip
+            calculator = calculators[tax_year]
+            if not reused or payslip_writer is not None:
+                result = calculator.compute(gross_salary)
+            if payslip_writer is not None:
+                payslip_writer.write(
+                    employee_id, tax_year, gross_salary, calculator
+                )
+
+            if reused:
+                writer.writerow(previous_row)
+                stats['reused'] += 1
+            else:
+                writer.writerow([
+                    employee_id, tax_year, gross_salary,
+                    result[TaxCalculator.TAXABLE_INCOME],
+                    result[TaxCalculator.TOTAL_TAX],
+                ])
+                stats['recomputed'] += 1
+        previous_rows.close()
+
+    def write_manifest(manifest_file):
+        json.dump({'schedules': schedules}, manifest_file)
+
+    _write_atomic(output_path, write_output)
+    _write_atomic(manifest_path, write_manifest)
+    logging.info('Batch run recomputed %(recomputed)d and reused %(reused)d '
+                 'results', stats)
+    return stats
@@ -78,3 +78,71 @@ DEFAULT_DATA = {
         }
     }
 }
+
+DEFAULT_RULES = {
+    '2018': {
+        'personal_allowance': 11850,
+        'allowance_taper': {
+            'threshold': 100000,
+            'ratio': 2
+        },
+        'jurisdictions': {
+            'rest_of_uk': {
+                'bands': [
+                    {
+                        'name': 'basic_rate',
+                        'rate': 20,
+                        'range_start': 0,
+                        'range_end': 34500
+                    },
+                    {
+                        'name': 'higher_rate',
+                        'rate': 40,
+                        'range_start': 34501,
+                        'range_end': 150000
+                    },
+                    {
+                        'name': 'additional_rate',
+                        'rate': 45,
+                        'range_start': 150000,
+                        'range_end': None
+                    }
+                ]
+            },
+            'scotland': {
+                'bands': [
+                    {
+                        'name': 'starter_rate',
+                        'rate': 19,
+                        'range_start': 0,
+                        'range_end': 2000
+                    },
+                    {
+                        'name': 'basic_rate',
+                        'rate': 20,
+                        'range_start': 2001,
+                        'range_end': 12150
+                    },
+                    {
+                        'name': 'intermediate_rate',
+                        'rate': 21,
+                        'range_start': 12151,
+                        'range_end': 31580
+                    },
+                    {
+                        'name': 'higher_rate',
+                        'rate': 41,
+                        'range_start': 31581,
+                        'range_end': 150000
+                    },
+                    {
+                        'name': 'top_rate',
+                        'rate': 46,
+                        'range_start': 150000,
+                        'range_end': None
+                    }
+                ]
+            }
+        }
+    }
+}
@@ -0,0 +1,94 @@
+import csv
+import heapq
+import logging
+import os
+import tempfile
+
+from batch import _parse_amount
+
+DEFAULT_MAX_RECORDS = 1000000
+MAX_OPEN_RUNS = 64
+
+
+def _write_run(path, items):
+    with open(path, 'w', newline='') as run_file:
+        writer = csv.writer(run_file)
+        for (employee_id, tax_year), gross_salary in items:
+            writer.writerow((employee_id, tax_year, gross_salary))
+
+
+def _read_run(path):
+    with open(path, newline='') as run_file:
+        for employee_id, tax_year, gross_salary in csv.reader(run_file):
+            yield (employee_id, tax_year), _parse_amount(gross_salary)
+
+
+def _combine(items):
+    """Sum the incomes of consecutive items with the same key"""
+    current_key = None
+    total = 0
+    for key, gross_salary in items:
+        if key != current_key:
+            if current_key is not None:
+                yield current_key, total
+            current_key = key
+            total = 0
+        total += gross_salary
+    if current_key is not None:
+        yield current_key, total
+
+
+def _merge_runs(paths):
+    return _combine(heapq.merge(*[_read_run(path) for path in paths]))
+
+
+def group_incomes(records, max_records=DEFAULT_MAX_RECORDS, tmp_dir=None):
+    """
+    Combine the gross salaries of all the employments of a person in a tax
+    year, for inputs larger than memory.
+
+    Takes (employee_id, tax_year, gross_salary) records in any order and
+    yields one record per employee and year, sorted by employee and year
+    as strings like batch.run_batch expects them.
+    At most max_records distinct employee and year totals are kept in
+    memory, above that the totals are spilled to sorted run files in
+    tmp_dir which are merged at the end, MAX_OPEN_RUNS at a time.
+    """
+    if max_records < 1:
+        raise ValueError("max_records must be a positive number")
+
+    totals = {}
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        runs = []
+        for employee_id, tax_year, gross_salary in records:
+            key = (str(employee_id), str(tax_year))
+            totals[key] = totals.get(key, 0) + gross_salary
+            if len(totals) >= max_records:
+                runs.append(os.path.join(run_dir, 'run%d.csv' % len(runs)))
+                _write_run(runs[-1], sorted(totals.items()))
+                totals = {}
+
+        if not runs:
+            for (employee_id, tax_year), gross_salary in sorted(
+                    totals.items()):
+                yield employee_id, tax_year, gross_salary
+            return
+
+        if totals:
+            runs.append(os.path.join(run_dir, 'run%d.csv' % len(runs)))
+            _write_run(runs[-1], sorted(totals.items()))
+            totals = {}
+        logging.debug('Spilled %d sorted runs to %s', len(runs), run_dir)
+
+        # Merge the runs in passes so only MAX_OPEN_RUNS files are open
+        merged = 0
+        while len(runs) > MAX_OPEN_RUNS:
+            path = os.path.join(run_dir, 'merged%d.csv' % merged)
+            _write_run(path, _merge_runs(runs[:MAX_OPEN_RUNS]))
+            for run in runs[:MAX_OPEN_RUNS]:
+                os.remove(run)
+            runs = runs[MAX_OPEN_RUNS:] + [path]
+            merged += 1
+
+        for (employee_id, tax_year), gross_salary in _merge_runs(runs):
+            yield employee_id, tax_year, gross_salary
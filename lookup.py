@@ -0,0 +1,177 @@
+import array
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+from CalculateTax import TaxCalculator
+
+DEFAULT_CAP = 300000
+
+
+class TaxLookupTable:
+    """
+    Precomputed results of a year for every whole pound salary from 0 up to
+    cap, so evaluating a salary is a single index into a flat array.
+
+    Each salary has a record laid out like TaxCalculator.result. The table is
+    either built in memory or, when a path is given, memory mapped from that
+    file, which is written on the first build. Salaries that are not whole
+    pounds or are above the cap fall back to the calculator.
+
+    init params:
+        year_tax_data: tax data of a year as found in the JSON file or a
+                       TaxSchedule
+        cap:           highest salary stored in the table
+        path:          optional file the table is persisted to and mapped
+                       from
+    """
+    MAGIC = b'TAXLUT1\n'
+
+    def __init__(self, year_tax_data=None, cap=DEFAULT_CAP, path=None):
+        if year_tax_data is None:
+            raise ValueError("year_tax_data can't be null")
+
+        if cap is None or cap < 0:
+            raise ValueError("cap must be a positive number")
+
+        self.year_tax_data = year_tax_data
+        self.cap = cap
+        self.path = path
+        self.calculator = TaxCalculator(year_tax_data)
+        self.record_size = self.calculator.record_size
+        self.build_seconds = 0.0
+        self._mmap = None
+
+        if path is not None and os.path.exists(path):
+            self.table = self._load(path)
+            if self.table is not None:
+                logging.debug('Mapped tax lookup table from %s', path)
+                return
+            logging.debug('Tax lookup table in %s is stale, rebuilding', path)
+
+        self.table = self._build()
+        if path is not None:
+            self.save(path)
+
+    @property
+    def nbytes(self):
+        """Memory used by the table"""
+        return len(self.table) * self.table.itemsize
+
+    def _header(self):
+        return {
+            'cap': self.cap,
+            'byteorder': sys.byteorder,
+            'personal_allowance': self.calculator.schedule.personal_allowance,
+            'bands': [list(band) for band in self.calculator.schedule.bands],
+            'taper_threshold': self.calculator.schedule.taper_threshold,
+            'taper_ratio': self.calculator.schedule.taper_ratio,
+        }
+
+    def _build(self):
+        start = time.perf_counter()
+        record_size = self.record_size
+        table = array.array('d', bytes(8 * record_size * (self.cap + 1)))
+        fill = self.calculator._fill
+        for gross_salary in range(self.cap + 1):
+            fill(gross_salary, table, gross_salary * record_size)
+        self.build_seconds = time.perf_counter() - start
+
+        logging.info(
+            'Built tax lookup table for salaries up to %d in %.3fs, '
+            'using %d bytes', self.cap, self.build_seconds,
+            len(table) * table.itemsize
+        )
+        return table
+
+    def save(self, path):
+        """
+        Write the table to path so it can be memory mapped later. The file
+        is written aside and moved into place, tables still mapping the
+        previous file keep reading it.
+        """
+        header = json.dumps(self._header()).encode('utf-8') + b'\n'
+        # Pad the header so the records are aligned on 8 bytes
+        padding = -(len(self.MAGIC) + len(header)) % 8
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=os.path.basename(path) + '.'
+        )
+        try:
+            # mkstemp only lets the owner read the file, give it the
+            # permissions of a file created with open()
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(self.MAGIC)
+                outfile.write(header[:-1] + b' ' * padding + b'\n')
+                outfile.write(memoryview(self.table).cast('B'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _load(self, path):
+        """Map the table in path, returning None if it doesn't match"""
+        with open(path, 'rb') as infile:
+            if infile.readline() != self.MAGIC:
+                return None
+            try:
+                header = json.loads(infile.readline().decode('utf-8'))
+            except ValueError:
+                return None
+            if header != json.loads(json.dumps(self._header())):
+                return None
+
+            offset = infile.tell()
+            size = 8 * self.record_size * (self.cap + 1)
+            if os.fstat(infile.fileno()).st_size != offset + size:
+                return None
+            self._mmap = mmap.mmap(
+                infile.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        return memoryview(self._mmap)[offset:offset + size].cast('d')
+
+    def close(self):
+        """Release the memory map of a table loaded from disk"""
+        if self._mmap is not None:
+            self.table.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def covers(self, gross_salary):
+        return isinstance(gross_salary, int) and 0 <= gross_salary <= self.cap
+
+    def lookup(self, gross_salary):
+        """
+        Result record for gross_salary, laid out like TaxCalculator. The
+        record is a copy, it stays valid after the table is closed.
+        """
+        if self.covers(gross_salary):
+            start = gross_salary * self.record_size
+            return array.array(
+                'd', self.table[start:start + self.record_size]
+            )
+        return self.calculator.calculate(gross_salary)
+
+    def total_tax(self, gross_salary):
+        if self.covers(gross_salary):
+            return self.table[
+                gross_salary * self.record_size + TaxCalculator.TOTAL_TAX
+            ]
+        return self.calculator.calculate(gross_salary)[
+            TaxCalculator.TOTAL_TAX
+        ]
+
+    def band_deduction(self, gross_salary, band):
+        index = (
+            TaxCalculator.BAND_AMOUNTS + self.calculator.band_count +
+            self.calculator.schedule.band_names.index(band)
+        )
+        return self.lookup(gross_salary)[index]
+
@@ -0,0 +1,164 @@
+import array
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+from CalculateTax import TaxCalculator, TaxSchedule
+
+_worker = {}
+
+
+def _init_worker(schedule, salaries_name, results_name):
+    """Attach a pool process to the shared salaries and results"""
+    _worker['calculator'] = TaxCalculator(schedule)
+    _worker['salaries_memory'] = shared_memory.SharedMemory(salaries_name)
+    _worker['results_memory'] = shared_memory.SharedMemory(results_name)
+    _worker['salaries'] = _worker['salaries_memory'].buf.cast('d')
+    _worker['results'] = _worker['results_memory'].buf.cast('d')
+
+
+def _compute_chunk(bounds):
+    """
+    Calculate the salaries from start to stop straight into the shared
+    results, only the bounds go back to the parent
+    """
+    start, stop = bounds
+    calculator = _worker['calculator']
+    record_size = calculator.record_size
+    salaries = _worker['salaries']
+
+    # The records are filled in a local array first, the shared buffer
+    # being a memoryview it only accepts floats
+    chunk = array.array('d', bytes(8 * record_size * (stop - start)))
+    fill = calculator._fill
+    offset = 0
+    for index in range(start, stop):
+        fill(salaries[index], chunk, offset)
+        offset += record_size
+    _worker['results'][start * record_size:stop * record_size] = chunk
+    return bounds
+
+
+class SharedResults:
+    """
+    Results of compute_shared(), one fixed width record per salary laid out
+    like TaxCalculator.result in a shared memory block. Columns are strided
+    views of the block, nothing is copied.
+
+    Must be closed, or used as a context manager, to free the block.
+    """
+    def __init__(self, memory, count, schedule):
+        self.memory = memory
+        self.count = count
+        self.schedule = schedule
+        self.band_count = len(schedule.bands)
+        self.record_size = TaxCalculator.BAND_AMOUNTS + 2 * self.band_count
+        # The block can be rounded up to a whole number of pages
+        self.records = memory.buf[:8 * count * self.record_size].cast('d')
+        self._views = [self.records]
+
+    def __len__(self):
+        return self.count
+
+    def _column(self, index):
+        view = self.records[index::self.record_size]
+        self._views.append(view)
+        return view
+
+    @property
+    def taxable_income(self):
+        return self._column(TaxCalculator.TAXABLE_INCOME)
+
+    @property
+    def total_tax(self):
+        return self._column(TaxCalculator.TOTAL_TAX)
+
+    def band_amounts(self, band):
+        return self._column(
+            TaxCalculator.BAND_AMOUNTS + self.schedule.band_names.index(band)
+        )
+
+    def band_deductions(self, band):
+        return self._column(
+            TaxCalculator.BAND_AMOUNTS + self.band_count +
+            self.schedule.band_names.index(band)
+        )
+
+    def record(self, index):
+        start = index * self.record_size
+        view = self.records[start:start + self.record_size]
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """Release the views and free the shared memory block"""
+        if self.memory is None:
+            return
+        for view in self._views:
+            view.release()
+        self._views = []
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compute_shared(salaries, year_data, processes=None, chunk_size=None):
+    """
+    Calculate the tax of salaries in a pool of processes which write their
+    results straight into shared memory, returning them as SharedResults.
+
+    year_data is the tax data of a year as found in the JSON file or a
+    TaxSchedule. The parent only hands out (start, stop) bounds and gets
+    them back once the chunk is written.
+    """
+    if isinstance(year_data, TaxSchedule):
+        schedule = year_data
+    else:
+        schedule = TaxSchedule.from_year_data(year_data)
+
+    salaries = array.array('d', salaries)
+    count = len(salaries)
+    record_size = TaxCalculator.BAND_AMOUNTS + 2 * len(schedule.bands)
+
+    # Empty shared memory blocks are not allowed
+    salaries_memory = shared_memory.SharedMemory(
+        create=True, size=max(1, 8 * count)
+    )
+    results_memory = shared_memory.SharedMemory(
+        create=True, size=max(1, 8 * count * record_size)
+    )
+    try:
+        salaries_memory.buf[:8 * count] = memoryview(salaries).cast('B')
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if chunk_size is None:
+            chunk_size = max(1, -(-count // (processes * 4)))
+        chunks = [
+            (start, min(start + chunk_size, count))
+            for start in range(0, count, chunk_size)
+        ]
+
+        if chunks:
+            with multiprocessing.Pool(
+                    processes, _init_worker,
+                    (schedule, salaries_memory.name, results_memory.name)
+            ) as pool:
+                for start, stop in pool.imap_unordered(
+                        _compute_chunk, chunks):
+                    logging.debug('Computed salaries %d to %d', start, stop)
+    except BaseException:
+        results_memory.close()
+        results_memory.unlink()
+        raise
+    finally:
+        salaries_memory.close()
+        salaries_memory.unlink()
+
+    return SharedResults(results_memory, count, schedule)
@@ -0,0 +1,255 @@
+import html
+import logging
+import os
+import re
+import zipfile
+
+from CalculateTax import GBP, TaxCalculator, _get_band_label
+
+DEFAULT_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Payslip {{ employee_id }}</title></head>
+<body>
+<h1>Tax Year: {{ tax_year }}</h1>
+<p>Employee: {{ employee_id }}</p>
+<table>
+<tr><th>Gross Salary</th><td>{{ gross_salary }}</td></tr>
+<tr><th>Personal Allowance</th><td>{{ personal_allowance }}</td></tr>
+<tr><th>Taxable Income</th><td>{{ taxable_income }}</td></tr>
+</table>
+<table>
+<tr><th>Band</th><th>Amount</th><th>Rate</th><th>Tax</th></tr>
+{{ bands|raw }}
+</table>
+<p>Total Tax Due: {{ total_tax }}</p>
+</body>
+</html>
+'''
+
+DEFAULT_BAND_TEMPLATE = (
+    '<tr><td>{{ name }}</td><td>{{ amount }}</td><td>{{ rate }}%</td>'
+    '<td>{{ deduction }}</td></tr>\n'
+)
+
+
+class PayslipTemplate:
+    """
+    Payslip template compiled once into literal parts and fields, so
+    rendering is a single join.
+
+    Fields are written {{ name }} and are HTML escaped, {{ name|raw }}
+    inserts a value as is.
+
+    init params:
+        source: template text
+    """
+    FIELD_PATTERN = re.compile(r'{{\s*(\w+)(\|raw)?\s*}}')
+
+    def __init__(self, source=None):
+        if source is None:
+            raise ValueError("source can't be null")
+
+        self.source = source
+        self.parts = []
+        self.fields = []
+        position = 0
+        for match in self.FIELD_PATTERN.finditer(source):
+            self.parts.append(source[position:match.start()])
+            self.fields.append((match.group(1), bool(match.group(2))))
+            position = match.end()
+        self.tail = source[position:]
+
+    def render(self, values):
+        pieces = []
+        for part, (name, raw) in zip(self.parts, self.fields):
+            pieces.append(part)
+            try:
+                value = values[name]
+            except KeyError:
+                raise ValueError("Payslip field %s is missing" % name)
+            pieces.append(str(value) if raw else html.escape(str(value)))
+        pieces.append(self.tail)
+        return ''.join(pieces)
+
+
+def payslip_fields(employee_id, tax_year, gross_salary, calculator,
+                   currency_format=GBP):
+    """
+    Structured payslip values of a salary, named after the IncomeTaxYearData
+    fields. The salary must just have been computed by calculator.
+    """
+    fmt = currency_format.format
+    result = calculator.result
+    bands = []
+    amount_index = TaxCalculator.BAND_AMOUNTS
+    for name, rate, _width in calculator.schedule.bands:
+        deduction = result[amount_index + calculator.band_count]
+        if deduction:
+            bands.append({
+                'name': _get_band_label(name).partition(':')[0],
+                'amount': fmt(result[amount_index]),
+                'rate': str(rate),
+                'deduction': fmt(deduction),
+            })
+        amount_index += 1
+
+    tax_year = int(tax_year)
+    return {
+        'employee_id': employee_id,
+        'tax_year': '%d-%d' % (tax_year, tax_year + 1),
+        'gross_salary': fmt(gross_salary),
+        'personal_allowance': fmt(
+            gross_salary - result[TaxCalculator.TAXABLE_INCOME]
+        ),
+        'taxable_income': fmt(result[TaxCalculator.TAXABLE_INCOME]),
+        'total_tax': fmt(result[TaxCalculator.TOTAL_TAX]),
+        'bands': bands,
+    }
+
+
+def _pdf_string(text):
+    text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('cp1252', errors='replace')
+
+
+def render_pdf(fields):
+    """Single page PDF payslip listing the payslip fields as text"""
+    lines = [
+        'Tax Year: %s' % fields['tax_year'],
+        'Employee: %s' % fields['employee_id'],
+        '',
+        'Gross Salary: %s' % fields['gross_salary'],
+        'Personal Allowance: %s' % fields['personal_allowance'],
+        'Taxable Income: %s' % fields['taxable_income'],
+        '',
+    ]
+    for band in fields['bands']:
+        lines.append('%(name)s: %(amount)s @ %(rate)s%% = %(deduction)s' %
+                     band)
+    lines.extend(['', 'Total Tax Due: %s' % fields['total_tax']])
+
+    content = [b'BT /F1 11 Tf 14 TL 56 780 Td']
+    for line in lines:
+        content.append(b'(' + _pdf_string(line) + b') Tj T*')
+    content.append(b'ET')
+    stream = b'\n'.join(content)
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        b'/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+        b'/Encoding /WinAnsiEncoding >>',
+        b'<< /Length %d >>\nstream\n' % len(stream) + stream +
+        b'\nendstream',
+    ]
+    document = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(document))
+        document += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+
+    xref_offset = len(document)
+    document += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        document += b'%010d 00000 n \n' % offset
+    document += (
+        b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n' %
+        (len(objects) + 1, xref_offset)
+    )
+    return bytes(document)
+
+
+class PayslipWriter:
+    """
+    Renders payslips with precompiled templates and streams them into a
+    directory, or into a single zip archive when output ends with .zip.
+    Payslips are named employee_year after the employee id and year, any
+    character other than a letter, digit, '.' or '-' percent encoded, so
+    every employee and year has its own file across runs.
+
+    init params:
+        output:          directory or .zip archive path
+        template:        PayslipTemplate or template text of the payslip
+        band_template:   PayslipTemplate or template text of a band row
+        pdf:             also write a PDF version of every payslip
+        currency_format: CurrencyFormat used for the amounts
+    """
+    UNSAFE_NAME = re.compile(r'[^A-Za-z0-9.-]')
+
+    def __init__(self, output=None, template=DEFAULT_TEMPLATE,
+                 band_template=DEFAULT_BAND_TEMPLATE, pdf=False,
+                 currency_format=GBP):
+        if output is None:
+            raise ValueError("output can't be null")
+
+        if not isinstance(template, PayslipTemplate):
+            template = PayslipTemplate(template)
+
+        if not isinstance(band_template, PayslipTemplate):
+            band_template = PayslipTemplate(band_template)
+
+        self.output = output
+        self.template = template
+        self.band_template = band_template
+        self.pdf = pdf
+        self.currency_format = currency_format
+        self.count = 0
+
+        if output.endswith('.zip'):
+            self._archive = zipfile.ZipFile(
+                output, 'w', compression=zipfile.ZIP_DEFLATED
+            )
+        else:
+            self._archive = None
+            os.makedirs(output, exist_ok=True)
+
+    def _store(self, name, data):
+        if self._archive is not None:
+            self._archive.writestr(name, data)
+        else:
+            with open(os.path.join(self.output, name), 'wb') as outfile:
+                outfile.write(data)
+
+    def _quote(self, value):
+        """Percent encode the characters of value unsafe in a file name"""
+        return self.UNSAFE_NAME.sub(
+            lambda match: ''.join(
+                '%%%02X' % byte for byte in match.group().encode('utf-8')
+            ),
+            str(value)
+        )
+
+    def write(self, employee_id, tax_year, gross_salary, calculator):
+        """
+        Write the payslip of a salary which must just have been computed
+        by calculator
+        """
+        fields = payslip_fields(
+            employee_id, tax_year, gross_salary, calculator,
+            self.currency_format
+        )
+        values = dict(fields, bands=''.join(
+            self.band_template.render(band) for band in fields['bands']
+        ))
+
+        name = '%s_%s' % (self._quote(employee_id), self._quote(tax_year))
+        self._store(
+            name + '.html', self.template.render(values).encode('utf-8')
+        )
+        if self.pdf:
+            self._store(name + '.pdf', render_pdf(fields))
+        self.count += 1
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        logging.info('Wrote %d payslips to %s', self.count, self.output)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,136 @@
+import logging
+
+from CalculateTax import TaxCalculator, TaxSchedule
+from defaults import DEFAULT_RULES
+
+
+def _compile_bands(bands):
+    """
+    Flatten a jurisdiction's list of bands into (name, rate, width) entries,
+    with the same band widths as TaxBand uses
+    """
+    compiled = []
+    names = set()
+    for index, band in enumerate(bands):
+        try:
+            name = band['name']
+            rate = band['rate']
+            range_start = band['range_start']
+            range_end = band.get('range_end')
+        except (KeyError, TypeError):
+            raise ValueError("Band %d is missing its name, rate or range" %
+                             index)
+
+        if name in names:
+            raise ValueError("The %s band is defined twice" % name)
+        names.add(name)
+
+        if compiled and compiled[-1][2] is None:
+            raise ValueError(
+                "The %s band comes after a band with no upper limit" % name
+            )
+
+        if range_end:
+            if range_end < range_start:
+                raise ValueError("The %s band ends before it starts" % name)
+            width = range_end - range_start
+        else:
+            width = None
+        compiled.append((name, rate, width))
+    return compiled
+
+
+def compile_rules(rules=None, year=None, jurisdiction=None):
+    """
+    Compile the rules of a year and jurisdiction into a TaxSchedule.
+
+    A year of the rules has a personal_allowance, an optional
+    allowance_taper with the gross salary threshold above which the
+    allowance is reduced by 1 for every ratio of income, and the band list
+    of each of its jurisdictions. A jurisdiction can override the
+    personal_allowance and allowance_taper of its year.
+    """
+    if rules is None:
+        raise ValueError("rules can't be null")
+
+    if year is None:
+        raise ValueError("year can't be null")
+
+    if jurisdiction is None:
+        raise ValueError("jurisdiction can't be null")
+
+    year = str(year)
+    try:
+        year_rules = rules[year]
+    except KeyError:
+        raise ValueError(
+            "Rules for year %s are not available. Rules are available for "
+            "the following years: %s" % (year, ', '.join(rules))
+        )
+
+    jurisdictions = year_rules.get('jurisdictions', {})
+    try:
+        jurisdiction_rules = jurisdictions[jurisdiction]
+    except KeyError:
+        raise ValueError(
+            "Rules for %s are not available in %s. Rules are available for "
+            "the following jurisdictions: %s" %
+            (jurisdiction, year, ', '.join(jurisdictions))
+        )
+
+    personal_allowance = jurisdiction_rules.get(
+        'personal_allowance', year_rules.get('personal_allowance')
+    )
+    if personal_allowance is None:
+        msg = ('Personal Allowance data is missing, '
+               'run command with -h to see available options.')
+        raise ValueError(msg)
+
+    taper = jurisdiction_rules.get(
+        'allowance_taper', year_rules.get('allowance_taper')
+    )
+    taper_threshold = None
+    taper_ratio = 2
+    if taper:
+        taper_threshold = taper['threshold']
+        taper_ratio = taper.get('ratio', taper_ratio)
+
+    logging.debug('Compiling tax rules of %s for %s', jurisdiction, year)
+    return TaxSchedule(
+        personal_allowance=personal_allowance,
+        bands=_compile_bands(jurisdiction_rules.get('bands', [])),
+        taper_threshold=taper_threshold,
+        taper_ratio=taper_ratio,
+    )
+
+
+class TaxRules:
+    """
+    Rules of all years and jurisdictions, compiled once per year and
+    jurisdiction into schedules and calculators.
+
+    init params:
+        rules: rules in the layout of defaults.DEFAULT_RULES
+    """
+    def __init__(self, rules=DEFAULT_RULES):
+        if rules is None:
+            raise ValueError("rules can't be null")
+
+        self.rules = rules
+        self._schedules = {}
+
+    def jurisdictions(self, year):
+        return sorted(self.rules.get(str(year), {}).get('jurisdictions', {}))
+
+    def get_schedule(self, year, jurisdiction):
+        key = (str(year), jurisdiction)
+        try:
+            return self._schedules[key]
+        except KeyError:
+            schedule = compile_rules(self.rules, year, jurisdiction)
+            self._schedules[key] = schedule
+            return schedule
+
+    def get_calculator(self, year, jurisdiction):
+        """New calculator, each one has its own result buffer"""
+        return TaxCalculator(self.get_schedule(year, jurisdiction))
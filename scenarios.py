@@ -0,0 +1,221 @@
+import array
+import bisect
+import copy
+import logging
+
+from CalculateTax import IncomeTaxYearData, TaxSchedule
+
+
+class SalaryPopulation:
+    """
+    Sorted gross salaries of a population with their running totals, so the
+    sum of any salary range is answered with two binary searches.
+
+    init params:
+        salaries: iterable of gross salaries
+    """
+    def __init__(self, salaries=None):
+        if salaries is None:
+            raise ValueError("salaries can't be null")
+
+        self.salaries = array.array('d', sorted(salaries))
+        self.prefix_sums = array.array('d', [0.0])
+        running_total = 0.0
+        for gross_salary in self.salaries:
+            running_total += gross_salary
+            self.prefix_sums.append(running_total)
+
+    def __len__(self):
+        return len(self.salaries)
+
+    def clamped_sum(self, base, width, floor=True):
+        """
+        Sum over the population of (salary - base) clamped to [0, width].
+        Without floor, salaries below base count as negative amounts, the
+        way the first band of a year treats salaries below the personal
+        allowance. A width of None has no upper limit.
+        """
+        salaries = self.salaries
+        start = bisect.bisect_left(salaries, base) if floor else 0
+        if width is None:
+            end = len(salaries)
+        else:
+            end = max(start, bisect.bisect_left(salaries, base + width))
+
+        in_band = self.prefix_sums[end] - self.prefix_sums[start]
+        band_sum = in_band - (end - start) * base
+        if width is not None:
+            band_sum += (len(salaries) - end) * width
+        return band_sum
+
+
+def _present_bands(year_tax_data):
+    return [
+        band for band in IncomeTaxYearData.BANDS if year_tax_data.get(band)
+    ]
+
+
+def _band_gaps(year_tax_data):
+    """
+    Distance between the start of every band and the end of the band below
+    it, None when the band below has no end
+    """
+    gaps = {}
+    bands = _present_bands(year_tax_data)
+    for lower, band in zip(bands, bands[1:]):
+        lower_end = year_tax_data[lower]['range_end']
+        if lower_end is None:
+            gaps[band] = None
+        else:
+            gaps[band] = year_tax_data[band]['range_start'] - lower_end
+    return gaps
+
+
+def apply_deltas(year_tax_data=None, deltas=None):
+    """
+    Copy of year_tax_data with deltas added to its numbers.
+
+    deltas mirrors the year layout of the JSON file. A band's threshold
+    moves its range_start together with the range_end of the band below,
+    for example moving the higher rate threshold up by 1000 and the basic
+    rate up by 1%:
+
+        {'basic_rate': {'rate': 1}, 'higher_rate': {'threshold': 1000}}
+
+    range_start and range_end can also be changed on their own, as long as
+    every band still starts where it did relative to the end of the band
+    below it.
+    """
+    if year_tax_data is None:
+        raise ValueError("year_tax_data can't be null")
+
+    if deltas is None:
+        raise ValueError("deltas can't be null")
+
+    scenario = copy.deepcopy(year_tax_data)
+    bands = _present_bands(scenario)
+    for key, delta in deltas.items():
+        if key == IncomeTaxYearData.PERSONAL_ALLOWANCE:
+            scenario[key] += delta
+            continue
+
+        if key not in IncomeTaxYearData.BANDS:
+            raise ValueError("%s is not a tax band" % key)
+
+        if not scenario.get(key):
+            raise ValueError("This year does have the %s band" % key)
+
+        for field, amount in delta.items():
+            if field == 'threshold':
+                index = bands.index(key)
+                if index == 0:
+                    raise ValueError(
+                        "The %s band is the lowest band, change the "
+                        "personal_allowance instead" % key
+                    )
+                scenario[bands[index - 1]]['range_end'] += amount
+                scenario[key]['range_start'] += amount
+                continue
+
+            if field not in ('rate', 'range_start', 'range_end'):
+                raise ValueError("%s can't be changed on a band" % field)
+            if scenario[key][field] is None:
+                raise ValueError(
+                    "The %s band has no %s to change" % (key, field)
+                )
+            scenario[key][field] += amount
+
+    base_gaps = _band_gaps(year_tax_data)
+    for band, gap in _band_gaps(scenario).items():
+        if gap != base_gaps[band]:
+            raise ValueError(
+                "The %s band would no longer start next to the band below "
+                "it, change its threshold instead" % band
+            )
+
+    for band in bands:
+        range_end = scenario[band]['range_end']
+        if range_end and range_end < scenario[band]['range_start']:
+            raise ValueError("The %s band would end before it starts" % band)
+    return scenario
+
+
+class ScenarioEngine:
+    """
+    What-if engine computing the total income tax of a population for a
+    base year and for scenarios changing its rates and thresholds.
+
+    The revenue of each band is the band rate applied to a clamped sum over
+    the sorted salaries, which only depends on the salaries between the band
+    thresholds. Those sums are cached, so a scenario only searches the
+    population again for bands whose thresholds moved and a pure rate change
+    costs no search at all.
+
+    init params:
+        year_tax_data: base tax data of a year as found in the JSON file
+        population:    SalaryPopulation, or an iterable of gross salaries
+    """
+    def __init__(self, year_tax_data=None, population=None):
+        if year_tax_data is None:
+            raise ValueError("year_tax_data can't be null")
+
+        if population is None:
+            raise ValueError("population can't be null")
+
+        if not isinstance(population, SalaryPopulation):
+            population = SalaryPopulation(population)
+
+        self.year_tax_data = year_tax_data
+        self.population = population
+        self._band_sums = {}
+        self.base_band_revenue = self._band_revenue(
+            TaxSchedule.from_year_data(year_tax_data)
+        )
+        self.base_revenue = sum(self.base_band_revenue.values())
+
+    def _band_sum(self, base, width, floor):
+        key = (base, width, floor)
+        try:
+            return self._band_sums[key]
+        except KeyError:
+            band_sum = self.population.clamped_sum(base, width, floor)
+            self._band_sums[key] = band_sum
+            return band_sum
+
+    def _band_revenue(self, schedule):
+        """Tax due per band over the whole population"""
+        band_revenue = {}
+        base = schedule.personal_allowance
+        floor = False
+        for name, rate, width in schedule.bands:
+            band_revenue[name] = (
+                rate * self._band_sum(base, width, floor)
+            ) / 100.0
+            if width is None:
+                # Nothing is left to be taxed in the bands after this one
+                break
+            base += width
+            floor = True
+
+        for name, _rate, _width in schedule.bands:
+            band_revenue.setdefault(name, 0.0)
+        return band_revenue
+
+    def evaluate(self, deltas):
+        """
+        Revenue of the scenario built by applying deltas to the base year,
+        as a dict with the total 'revenue', the 'revenue_delta' against the
+        base year and the 'band_revenue_delta' per band
+        """
+        scenario = apply_deltas(self.year_tax_data, deltas)
+        band_revenue = self._band_revenue(TaxSchedule.from_year_data(scenario))
+        revenue = sum(band_revenue.values())
+        logging.debug('Evaluated scenario %s: %s', deltas, revenue)
+        return {
+            'revenue': revenue,
+            'revenue_delta': revenue - self.base_revenue,
+            'band_revenue_delta': {
+                name: band_revenue[name] - self.base_band_revenue.get(name, 0)
+                for name in band_revenue
+            },
+        }
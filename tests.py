@@ -1,17 +1,43 @@
 #!/usr/bin/python3
 
 import argparse
+import array
+import copy
+import csv
 import json
+import locale
+import os
+import random
+import sys
+import tempfile
+import time
 import unittest
+import zipfile
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
 
 from CalculateTax import (
+    _get_locale_currency_format,
     _validate_salary,
     _validate_year,
+    CurrencyFormat,
+    GBP,
     IncomeTaxYearData,
     TaxBand,
+    TaxCalculator,
+    TaxSchedule,
 )
-from defaults import DEFAULT_DATA, TAX_DATA_FILE_NAME
+from aggregate import PopulationAggregate, QuantileSketch, aggregate_files
+from batch import read_records, run_batch, write_records
+from defaults import DEFAULT_DATA, DEFAULT_RULES, TAX_DATA_FILE_NAME
+import external_sort
+from external_sort import group_incomes
+from lookup import TaxLookupTable
+from parallel import compute_shared
+from payslips import PayslipTemplate, PayslipWriter, payslip_fields
+from rules import TaxRules, compile_rules
+from scenarios import ScenarioEngine, SalaryPopulation, apply_deltas
 
 
 class TestUtilFunctions(unittest.TestCase):
@@ -411,5 +437,1175 @@ class TestTaxBand(unittest.TestCase):
         self.assertEqual(cm.exception.args[0], msg)
 
 
+class TestTaxCalculator(unittest.TestCase):
+    salaries = [0, 5000, 11000, 25000, 30000, 43000, 43001, 100000, 150000,
+                161850, 200000, 1000000]
+
+    def assertMatchesReference(self, calculator, year, gross_salary):
+        reference = IncomeTaxYearData(
+            year=year, tax_data=DEFAULT_DATA, gross_salary=gross_salary
+        )
+        calculator.compute(gross_salary)
+        self.assertEqual(calculator.taxable_income, reference.taxable_income)
+
+        total_tax = 0
+        for band in calculator.schedule.band_names:
+            tax_band = getattr(reference, band)
+            self.assertEqual(
+                calculator.band_amount(band), tax_band.range_amount
+            )
+            self.assertEqual(
+                calculator.band_deduction(band), tax_band.band_deduction
+            )
+            total_tax += tax_band.band_deduction
+        self.assertEqual(calculator.total_tax, total_tax)
+
+    def test_init_year_data_is_null(self):
+        with self.assertRaises(ValueError) as cm:
+            TaxCalculator(year_data=None)
+        msg = "year_data can't be null"
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_init_missing_personal_allowance(self):
+        with self.assertRaises(ValueError) as cm:
+            TaxCalculator({'basic_rate': None})
+        msg = ("Personal Allowance data is missing, run command with -h to "
+               "see available options.")
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_schedule_from_tax_data_unknown_year(self):
+        with self.assertRaises(ValueError):
+            TaxSchedule.from_tax_data(year=1999, tax_data=DEFAULT_DATA)
+
+    def test_schedule_skips_missing_bands(self):
+        schedule = TaxSchedule.from_tax_data(year=2016, tax_data=DEFAULT_DATA)
+        self.assertEqual(schedule.personal_allowance, 11000)
+        self.assertEqual(
+            schedule.bands,
+            (('basic_rate', 20, 32000), ('higher_rate', 40, 117999))
+        )
+
+    def test_compute_matches_reference(self):
+        for year in DEFAULT_DATA:
+            calculator = TaxCalculator(DEFAULT_DATA[year])
+            for gross_salary in self.salaries:
+                self.assertMatchesReference(calculator, year, gross_salary)
+
+    def test_compute_reuses_result_buffer(self):
+        calculator = TaxCalculator(DEFAULT_DATA['2018'])
+        result = calculator.compute(30000)
+        self.assertIs(calculator.compute(40000), result)
+        self.assertEqual(len(result), 2 + 2 * 5)
+
+    def test_compute_into(self):
+        calculator = TaxCalculator(DEFAULT_DATA['2016'])
+        out_array = array.array('d', bytes(8 * len(self.salaries)))
+        calculator.compute_into(self.salaries, out_array)
+        for gross_salary, total_tax in zip(self.salaries, out_array):
+            calculator.compute(gross_salary)
+            self.assertEqual(total_tax, calculator.total_tax)
+        self.assertEqual(out_array[3], 2800.0)
+
+
+def localeconv(**fields):
+    """locale.localeconv() of a pound locale, with fields changed"""
+    conv = {
+        'currency_symbol': '\u00a3', 'mon_thousands_sep': ',',
+        'mon_decimal_point': '.', 'mon_grouping': [3, 3, 0],
+        'frac_digits': 2, 'positive_sign': '', 'negative_sign': '-',
+        'p_cs_precedes': 1, 'p_sep_by_space': 0, 'p_sign_posn': 1,
+        'n_cs_precedes': 1, 'n_sep_by_space': 0, 'n_sign_posn': 1,
+    }
+    conv.update(fields)
+    return conv
+
+
+DE_DE_CONV = localeconv(
+    currency_symbol='\u20ac', mon_thousands_sep='.', mon_decimal_point=',',
+    p_cs_precedes=0, p_sep_by_space=1, n_cs_precedes=0, n_sep_by_space=1
+)
+
+
+class TestCurrencyFormat(unittest.TestCase):
+    def test_format_default(self):
+        self.assertEqual(GBP.format(30000), '\u00a330,000.00')
+        self.assertEqual(GBP.format(2029.8), '\u00a32,029.80')
+        self.assertEqual(GBP.format(0), '\u00a30.00')
+
+    def test_format_negative(self):
+        self.assertEqual(GBP.format(-1200), '-\u00a31,200.00')
+
+    def test_format_custom(self):
+        euro = CurrencyFormat(
+            symbol='\u20ac', thousands_sep='.', decimal_point=',',
+            frac_digits=2
+        )
+        self.assertEqual(euro.format(1234567.891), '\u20ac1.234.567,89')
+
+    def test_from_localeconv(self):
+        currency_format = CurrencyFormat.from_localeconv(localeconv(
+            currency_symbol='$', mon_thousands_sep=' ', frac_digits=0
+        ))
+        self.assertEqual(currency_format.format(1234567), '$1 234 567')
+
+    def test_from_localeconv_symbol_after_amount(self):
+        currency_format = CurrencyFormat.from_localeconv(DE_DE_CONV)
+        self.assertEqual(currency_format.format(30000), '30.000,00 \u20ac')
+        self.assertEqual(currency_format.format(-5.5), '-5,50 \u20ac')
+
+    def test_from_localeconv_indian_grouping(self):
+        currency_format = CurrencyFormat.from_localeconv(localeconv(
+            currency_symbol='\u20b9', mon_grouping=[3, 2, 0]
+        ))
+        self.assertEqual(
+            currency_format.format(12345678), '\u20b91,23,45,678.00'
+        )
+
+    def test_matches_locale_currency(self):
+        convs = [
+            localeconv(), DE_DE_CONV,
+            localeconv(mon_grouping=[3, 2, 0]),
+            localeconv(mon_grouping=[3, locale.CHAR_MAX]),
+            localeconv(mon_grouping=[2]),
+            localeconv(mon_grouping=[]),
+            localeconv(n_sign_posn=0, n_sep_by_space=1),
+            localeconv(n_sign_posn=2, n_cs_precedes=0),
+            localeconv(p_sign_posn=3, positive_sign='+'),
+            localeconv(n_sign_posn=4, n_sep_by_space=1),
+            localeconv(n_sign_posn=locale.CHAR_MAX),
+            localeconv(frac_digits=0),
+        ]
+        amounts = [0, 7, 999, 1000, 1234.5, 1234567.891, 123456789, -0.5,
+                   -1000, -1234567.891]
+        for conv in convs:
+            currency_format = CurrencyFormat.from_localeconv(conv)
+            with mock.patch('locale.localeconv', return_value=conv):
+                for amount in amounts:
+                    self.assertEqual(
+                        currency_format.format(amount),
+                        locale.currency(amount, grouping=True),
+                        '%s with %s' % (amount, conv)
+                    )
+
+    def test_locale_currency_format(self):
+        with mock.patch('locale.localeconv', return_value=DE_DE_CONV):
+            currency_format = _get_locale_currency_format()
+        self.assertEqual(currency_format.format(30000), '30.000,00 \u20ac')
+
+    def test_c_locale_currency_format_is_gbp(self):
+        conv = localeconv(currency_symbol='', frac_digits=locale.CHAR_MAX)
+        with mock.patch('locale.localeconv', return_value=conv):
+            self.assertIs(_get_locale_currency_format(), GBP)
+
+    def test_income_tax_year_data_defaults_to_gbp(self):
+        with mock.patch('locale.localeconv') as localeconv_mock:
+            year_data = IncomeTaxYearData(
+                year=2016, tax_data=DEFAULT_DATA, gross_salary=30000
+            )
+        self.assertIs(year_data.currency_format, GBP)
+        localeconv_mock.assert_not_called()
+
+    def test_income_tax_year_data_labels(self):
+        year_data = IncomeTaxYearData(
+            year=2016, tax_data=DEFAULT_DATA, gross_salary=25000,
+            currency_format=GBP
+        )
+        self.assertEqual(
+            year_data.get_breakdown(),
+            "Gross Salary: \u00a325,000.00\n\n"
+            "Personal Allowance: \u00a311,000.00\n\n"
+            "Taxable Income: \u00a314,000.00\n\n"
+            "Basic Rate: \u00a314,000.00 @ 20% = \u00a32,800.00\n\n"
+            "Total Tax Due: \u00a32,800.00\n"
+        )
+
+    def test_calculator_breakdown_matches_reference(self):
+        for year in DEFAULT_DATA:
+            calculator = TaxCalculator(DEFAULT_DATA[year])
+            for gross_salary in TestTaxCalculator.salaries:
+                reference = IncomeTaxYearData(
+                    year=year, tax_data=DEFAULT_DATA,
+                    gross_salary=gross_salary, currency_format=GBP
+                )
+                self.assertEqual(
+                    calculator.get_breakdown(gross_salary, GBP),
+                    reference.get_breakdown()
+                )
+
+
+class TestConcurrency(unittest.TestCase):
+    """
+    Stress test driving a shared calculator from a thread pool. Throughput
+    per thread count is written to stderr to show the scaling, which is
+    only expected on free-threaded builds.
+    """
+    thread_counts = (1, 2, 4, 8)
+    salaries = list(range(0, 400000, 50))
+
+    def _run(self, calculator, thread_count):
+        chunk_size = len(self.salaries) // (thread_count * 4) + 1
+        chunks = [
+            self.salaries[start:start + chunk_size]
+            for start in range(0, len(self.salaries), chunk_size)
+        ]
+
+        def work(chunk):
+            return [
+                (calculator.calculate(salary)[TaxCalculator.TOTAL_TAX],
+                 calculator.get_breakdown(salary, GBP))
+                for salary in chunk
+            ]
+
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = []
+            for chunk_results in executor.map(work, chunks):
+                results.extend(chunk_results)
+        return results
+
+    def test_thread_pool_stress(self):
+        calculator = TaxCalculator(DEFAULT_DATA['2018'])
+        expected = [
+            (calculator.calculate(salary)[TaxCalculator.TOTAL_TAX],
+             calculator.get_breakdown(salary, GBP))
+            for salary in self.salaries
+        ]
+
+        is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+        report = ['thread scaling (GIL %s):' % (
+            'enabled' if is_gil_enabled else 'disabled'
+        )]
+        base_rate = None
+        for thread_count in self.thread_counts:
+            start = time.perf_counter()
+            results = self._run(calculator, thread_count)
+            elapsed = time.perf_counter() - start
+            self.assertEqual(results, expected)
+
+            rate = len(self.salaries) / elapsed
+            if base_rate is None:
+                base_rate = rate
+            report.append('  %d threads: %.0f salaries/s (x%.2f)' % (
+                thread_count, rate, rate / base_rate
+            ))
+        sys.stderr.write('\n' + '\n'.join(report) + '\n')
+
+
+class TestTaxLookupTable(unittest.TestCase):
+    def setUp(self):
+        self.year_data = DEFAULT_DATA['2018']
+        self.calculator = TaxCalculator(self.year_data)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, '2018.lut')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertMatchesCalculator(self, table, gross_salary):
+        self.assertEqual(
+            list(table.lookup(gross_salary)),
+            list(self.calculator.compute(gross_salary))
+        )
+        self.assertEqual(
+            table.total_tax(gross_salary), self.calculator.total_tax
+        )
+
+    def test_init_year_tax_data_is_null(self):
+        with self.assertRaises(ValueError) as cm:
+            TaxLookupTable(year_tax_data=None)
+        msg = "year_tax_data can't be null"
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_lookup_in_memory(self):
+        table = TaxLookupTable(self.year_data, cap=50000)
+        self.assertEqual(table.nbytes, 8 * 12 * 50001)
+        for gross_salary in (0, 1, 11850, 30000, 43430, 50000):
+            self.assertMatchesCalculator(table, gross_salary)
+        self.assertEqual(table.band_deduction(30000, 'basic_rate'), 2029.8)
+
+    def test_lookup_beyond_cap_falls_back(self):
+        table = TaxLookupTable(self.year_data, cap=1000)
+        for gross_salary in (1001, 30000, 30000.5, 200000, -1):
+            self.assertMatchesCalculator(table, gross_salary)
+
+    def test_persisted_table_is_mapped(self):
+        table = TaxLookupTable(self.year_data, cap=20000, path=self.path)
+        self.assertTrue(os.path.exists(self.path))
+
+        mapped = TaxLookupTable(self.year_data, cap=20000, path=self.path)
+        self.assertEqual(mapped.build_seconds, 0.0)
+        self.assertEqual(list(mapped.table), list(table.table))
+        self.assertMatchesCalculator(mapped, 15000)
+        mapped.close()
+
+    def test_close_mapped_table_after_lookup(self):
+        TaxLookupTable(self.year_data, cap=20000, path=self.path)
+        mapped = TaxLookupTable(self.year_data, cap=20000, path=self.path)
+        record = mapped.lookup(15000)
+        mapped.close()
+        self.assertEqual(list(record), list(self.calculator.compute(15000)))
+
+    def test_rebuild_keeps_mapped_readers_valid(self):
+        TaxLookupTable(self.year_data, cap=50000, path=self.path)
+        reader = TaxLookupTable(self.year_data, cap=50000, path=self.path)
+        TaxLookupTable(DEFAULT_DATA['2016'], cap=1000, path=self.path)
+        self.assertMatchesCalculator(reader, 40000)
+        reader.close()
+        self.assertEqual(
+            [name for name in os.listdir(self.tmp_dir.name)], ['2018.lut']
+        )
+
+    def test_schedule_beyond_cap(self):
+        schedule = TaxRules().get_schedule(2018, 'rest_of_uk')
+        calculator = TaxCalculator(schedule)
+        table = TaxLookupTable(schedule, cap=1000)
+        for gross_salary in (30000, 30000.5, 120000):
+            self.assertEqual(
+                list(table.lookup(gross_salary)),
+                list(calculator.compute(gross_salary))
+            )
+
+    def test_persisted_table_keeps_taper(self):
+        schedule = TaxRules().get_schedule(2018, 'rest_of_uk')
+        untapered = TaxSchedule(schedule.personal_allowance, schedule.bands)
+        TaxLookupTable(untapered, cap=1000, path=self.path)
+        table = TaxLookupTable(schedule, cap=1000, path=self.path)
+        self.assertNotEqual(table.build_seconds, 0.0)
+        table.close()
+
+    def test_persisted_table_is_readable_by_others(self):
+        umask = os.umask(0o022)
+        try:
+            TaxLookupTable(self.year_data, cap=10, path=self.path)
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_stale_persisted_table_is_rebuilt(self):
+        TaxLookupTable(DEFAULT_DATA['2016'], cap=20000, path=self.path)
+        table = TaxLookupTable(self.year_data, cap=20000, path=self.path)
+        self.assertMatchesCalculator(table, 15000)
+        table.close()
+
+
+class TestScenarioEngine(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2018)
+        self.salaries = [rnd.randint(0, 300000) for _ in range(2000)]
+        self.salaries.extend([0, 11850, 43430, 161850, 161851])
+        self.population = SalaryPopulation(self.salaries)
+
+    def total_tax(self, year_tax_data):
+        calculator = TaxCalculator(year_tax_data)
+        return sum(calculator.compute(salary)[TaxCalculator.TOTAL_TAX]
+                   for salary in self.salaries)
+
+    def test_clamped_sum(self):
+        population = SalaryPopulation([5, 10, 20, 40])
+        self.assertEqual(population.clamped_sum(10, 15), 0 + 10 + 15)
+        self.assertEqual(population.clamped_sum(10, None), 0 + 10 + 30)
+        self.assertEqual(
+            population.clamped_sum(10, 15, floor=False), -5 + 0 + 10 + 15
+        )
+
+    def test_base_revenue_matches_calculator(self):
+        for year in DEFAULT_DATA:
+            engine = ScenarioEngine(DEFAULT_DATA[year], self.population)
+            self.assertAlmostEqual(
+                engine.base_revenue, self.total_tax(DEFAULT_DATA[year]),
+                places=3
+            )
+
+    def test_evaluate_matches_calculator(self):
+        scenarios = [
+            {'higher_rate': {'threshold': 1000}},
+            {'intermediate_rate': {'range_end': 1000},
+             'higher_rate': {'range_start': 1000}},
+            {'basic_rate': {'rate': 1}},
+            {'personal_allowance': -500, 'top_rate': {'threshold': -10000}},
+        ]
+        engine = ScenarioEngine(DEFAULT_DATA['2018'], self.population)
+        base = self.total_tax(DEFAULT_DATA['2018'])
+        for deltas in scenarios:
+            expected = self.total_tax(
+                apply_deltas(DEFAULT_DATA['2018'], deltas)
+            )
+            result = engine.evaluate(deltas)
+            self.assertAlmostEqual(result['revenue'], expected, places=3)
+            self.assertAlmostEqual(
+                result['revenue_delta'], expected - base, places=3
+            )
+
+    def test_evaluate_band_revenue_delta(self):
+        engine = ScenarioEngine(DEFAULT_DATA['2016'], [30000, 40000])
+        result = engine.evaluate({'basic_rate': {'rate': 1}})
+        self.assertEqual(
+            result['band_revenue_delta'],
+            {'basic_rate': 190.0 + 290.0, 'higher_rate': 0.0}
+        )
+
+    def test_apply_deltas_does_not_change_base(self):
+        scenario = apply_deltas(
+            DEFAULT_DATA['2016'], {'higher_rate': {'threshold': 1000}}
+        )
+        self.assertEqual(scenario['higher_rate']['range_start'], 33001)
+        self.assertEqual(DEFAULT_DATA['2016']['higher_rate']['range_start'],
+                         32001)
+
+    def test_apply_deltas_threshold(self):
+        scenario = apply_deltas(
+            DEFAULT_DATA['2018'], {'higher_rate': {'threshold': 1000}}
+        )
+        self.assertEqual(scenario['intermediate_rate']['range_end'], 32580)
+        self.assertEqual(scenario['higher_rate']['range_start'], 32581)
+        self.assertEqual(scenario['higher_rate']['range_end'], 150000)
+        self.assertEqual(scenario['top_rate']['range_start'], 150000)
+
+    def test_apply_deltas_threshold_of_lowest_band(self):
+        with self.assertRaises(ValueError):
+            apply_deltas(
+                DEFAULT_DATA['2016'], {'basic_rate': {'threshold': 1000}}
+            )
+
+    def test_apply_deltas_range_start_alone(self):
+        with self.assertRaises(ValueError) as cm:
+            apply_deltas(
+                DEFAULT_DATA['2018'], {'higher_rate': {'range_start': 1000}}
+            )
+        msg = ("The higher_rate band would no longer start next to the band "
+               "below it, change its threshold instead")
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_apply_deltas_missing_band(self):
+        with self.assertRaises(ValueError) as cm:
+            apply_deltas(DEFAULT_DATA['2016'], {'top_rate': {'rate': 1}})
+        msg = "This year does have the top_rate band"
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_apply_deltas_unknown_field(self):
+        with self.assertRaises(ValueError):
+            apply_deltas(DEFAULT_DATA['2016'], {'basic_rate': {'foo': 1}})
+
+
+class TestBatchRecords(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'batch.csv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write_read_records(self):
+        records = [('e1', '2018', 30000), ('e2', '2016', 45000.5)]
+        write_records(self.path, records)
+        self.assertEqual(list(read_records(self.path)), records)
+
+    def test_read_records_without_header(self):
+        with open(self.path, 'w') as batch_file:
+            batch_file.write('e1,2018,30000\n\ne2,2017,20000\n')
+        self.assertEqual(
+            list(read_records(self.path)),
+            [('e1', '2018', 30000), ('e2', '2017', 20000)]
+        )
+
+    def test_read_records_bad_record(self):
+        with open(self.path, 'w') as batch_file:
+            batch_file.write('e1,2018,foo\n')
+        with self.assertRaises(ValueError) as cm:
+            list(read_records(self.path))
+        msg = "%s:1 is not a valid batch record: e1,2018,foo" % self.path
+        self.assertEqual(cm.exception.args[0], msg)
+
+
+class TestIncrementalBatch(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(32)
+        self.records = [
+            ('e%d' % index, year, rnd.randint(1, 250000))
+            for index in range(200) for year in ('2017', '2018')
+        ]
+        self.records.sort()
+        self.tax_data = copy.deepcopy(DEFAULT_DATA)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self.tmp_dir.name, 'results.csv')
+        self.full_path = os.path.join(self.tmp_dir.name, 'full.csv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_output(self, path):
+        with open(path, newline='') as output_file:
+            return list(csv.reader(output_file))
+
+    def assertMatchesFullRun(self):
+        run_batch(self.records, self.tax_data, self.full_path)
+        self.assertEqual(
+            self.read_output(self.output_path),
+            self.read_output(self.full_path)
+        )
+
+    def test_first_run_computes_everything(self):
+        stats = run_batch(self.records, self.tax_data, self.output_path)
+        self.assertEqual(stats, {'recomputed': 400, 'reused': 0})
+        rows = self.read_output(self.output_path)
+        self.assertEqual(rows[0], ['employee_id', 'tax_year', 'gross_salary',
+                                   'taxable_income', 'total_tax'])
+        calculator = TaxCalculator(DEFAULT_DATA['2017'])
+        calculator.compute(self.records[0][2])
+        self.assertEqual(float(rows[1][4]), calculator.total_tax)
+
+    def test_unchanged_run_reuses_everything(self):
+        run_batch(self.records, self.tax_data, self.output_path)
+        stats = run_batch(self.records, self.tax_data, self.output_path)
+        self.assertEqual(stats, {'recomputed': 0, 'reused': 400})
+        self.assertMatchesFullRun()
+
+    def test_changed_salaries_are_recomputed(self):
+        run_batch(self.records, self.tax_data, self.output_path)
+        self.records[3] = self.records[3][:2] + (self.records[3][2] + 1,)
+        self.records[10] = self.records[10][:2] + (55555,)
+        self.records.append(('new', '2018', 42000))
+        del self.records[0]
+        self.records.sort()
+        stats = run_batch(self.records, self.tax_data, self.output_path)
+        self.assertEqual(stats, {'recomputed': 3, 'reused': 397})
+        self.assertMatchesFullRun()
+
+    def test_changed_year_is_recomputed(self):
+        run_batch(self.records, self.tax_data, self.output_path)
+        self.tax_data['2018']['personal_allowance'] += 100
+        stats = run_batch(self.records, self.tax_data, self.output_path)
+        self.assertEqual(stats, {'recomputed': 200, 'reused': 200})
+        self.assertMatchesFullRun()
+
+    def test_non_string_ids_are_reused(self):
+        records = [(1, 2018, 30000), (2, 2017, 45000)]
+        run_batch(records, self.tax_data, self.output_path)
+        stats = run_batch(records, self.tax_data, self.output_path)
+        self.assertEqual(stats, {'recomputed': 0, 'reused': 2})
+
+    def test_duplicate_records(self):
+        self.records.insert(1, self.records[0])
+        with self.assertRaises(ValueError) as cm:
+            run_batch(self.records, self.tax_data, self.output_path)
+        self.assertIn('more than one record', cm.exception.args[0])
+
+    def test_unsorted_records(self):
+        self.records.reverse()
+        with self.assertRaises(ValueError) as cm:
+            run_batch(self.records, self.tax_data, self.output_path)
+        self.assertIn('must be sorted', cm.exception.args[0])
+        self.assertFalse(os.path.exists(self.output_path))
+        self.assertFalse(os.path.exists(self.output_path + '.tmp'))
+
+
+class TestGroupIncomes(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(35)
+        self.records = [
+            ('e%d' % rnd.randint(0, 50), rnd.choice(['2017', '2018']),
+             rnd.randint(1, 50000))
+            for _ in range(1000)
+        ]
+        expected = {}
+        for employee_id, tax_year, gross_salary in self.records:
+            key = (employee_id, tax_year)
+            expected[key] = expected.get(key, 0) + gross_salary
+        self.expected = [key + (total,)
+                         for key, total in sorted(expected.items())]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_in_memory(self):
+        self.assertEqual(list(group_incomes(self.records)), self.expected)
+
+    def test_spilled_runs(self):
+        grouped = group_incomes(
+            self.records, max_records=7, tmp_dir=self.tmp_dir.name
+        )
+        self.assertEqual(list(grouped), self.expected)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_multiple_merge_passes(self):
+        with mock.patch.object(external_sort, 'MAX_OPEN_RUNS', 4):
+            grouped = list(group_incomes(self.records, max_records=5))
+        self.assertEqual(grouped, self.expected)
+
+    def test_invalid_max_records(self):
+        with self.assertRaises(ValueError):
+            list(group_incomes(self.records, max_records=0))
+
+    def test_non_string_ids(self):
+        records = [(10, 2018, 1000), (2, 2018, 2000), (10, 2018, 500)]
+        grouped = group_incomes(
+            records, max_records=1, tmp_dir=self.tmp_dir.name
+        )
+        self.assertEqual(
+            list(grouped), [('10', '2018', 1500), ('2', '2018', 2000)]
+        )
+
+    def test_feeds_batch(self):
+        output_path = os.path.join(self.tmp_dir.name, 'results.csv')
+        run_batch(group_incomes(self.records, max_records=10),
+                  DEFAULT_DATA, output_path)
+        with open(output_path, newline='') as output_file:
+            rows = list(csv.reader(output_file))[1:]
+        self.assertEqual(
+            [(row[0], row[1], int(row[2])) for row in rows], self.expected
+        )
+
+
+class TestPayslips(unittest.TestCase):
+    def setUp(self):
+        self.calculator = TaxCalculator(DEFAULT_DATA['2016'])
+        self.calculator.compute(25000)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_template_render(self):
+        template = PayslipTemplate('<p>{{ name }}</p>{{name|raw}}.')
+        self.assertEqual(
+            template.render({'name': '<b>'}), '<p>&lt;b&gt;</p><b>.'
+        )
+
+    def test_template_missing_field(self):
+        template = PayslipTemplate('{{ name }}')
+        with self.assertRaises(ValueError) as cm:
+            template.render({})
+        self.assertEqual(cm.exception.args[0], "Payslip field name is missing")
+
+    def test_payslip_fields(self):
+        fields = payslip_fields('e1', '2016', 25000, self.calculator, GBP)
+        self.assertEqual(fields['tax_year'], '2016-2017')
+        self.assertEqual(fields['personal_allowance'], '\u00a311,000.00')
+        self.assertEqual(fields['taxable_income'], '\u00a314,000.00')
+        self.assertEqual(fields['total_tax'], '\u00a32,800.00')
+        self.assertEqual(fields['bands'], [{
+            'name': 'Basic Rate', 'amount': '\u00a314,000.00', 'rate': '20',
+            'deduction': '\u00a32,800.00',
+        }])
+
+    def test_write_directory(self):
+        output = os.path.join(self.tmp_dir.name, 'payslips')
+        with PayslipWriter(output, pdf=True) as writer:
+            writer.write('e/1', '2016', 25000, self.calculator)
+        self.assertEqual(
+            sorted(os.listdir(output)), ['e%2F1_2016.html', 'e%2F1_2016.pdf']
+        )
+        with open(os.path.join(output, 'e%2F1_2016.html')) as payslip:
+            content = payslip.read()
+        self.assertIn('<td>Basic Rate</td><td>\u00a314,000.00</td>', content)
+        with open(os.path.join(output, 'e%2F1_2016.pdf'), 'rb') as payslip:
+            content = payslip.read()
+        self.assertTrue(content.startswith(b'%PDF-1.4'))
+        self.assertTrue(content.endswith(b'%EOF\n'))
+        self.assertIn(b'(Total Tax Due: \xa32,800.00) Tj', content)
+
+    def test_write_unsafe_names_stay_distinct(self):
+        output = os.path.join(self.tmp_dir.name, 'payslips')
+        with PayslipWriter(output) as writer:
+            writer.write('e_1', '2016', 25000, self.calculator)
+        with PayslipWriter(output) as writer:
+            writer.write('e/1', '2016', 25000, self.calculator)
+        self.assertEqual(
+            sorted(os.listdir(output)),
+            ['e%2F1_2016.html', 'e%5F1_2016.html']
+        )
+
+    def test_batch_writes_archive(self):
+        records = [('e1', '2016', 25000), ('e2', '2018', 60000)]
+        archive_path = os.path.join(self.tmp_dir.name, 'payslips.zip')
+        with PayslipWriter(archive_path) as writer:
+            run_batch(
+                records, DEFAULT_DATA,
+                os.path.join(self.tmp_dir.name, 'results.csv'),
+                payslip_writer=writer
+            )
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertEqual(
+                archive.namelist(), ['e1_2016.html', 'e2_2018.html']
+            )
+            content = archive.read('e2_2018.html').decode('utf-8')
+        self.assertIn('Tax Year: 2018-2019', content)
+        self.assertIn('<td>Higher Rate</td>', content)
+
+    def test_batch_keeps_reused_payslips(self):
+        records = [('e1', '2016', 25000), ('e2', '2018', 60000)]
+        output_path = os.path.join(self.tmp_dir.name, 'results.csv')
+        run_batch(records, DEFAULT_DATA, output_path)
+        records[1] = ('e2', '2018', 65000)
+        archive_path = os.path.join(self.tmp_dir.name, 'payslips.zip')
+        with PayslipWriter(archive_path) as writer:
+            run_batch(records, DEFAULT_DATA, output_path,
+                      payslip_writer=writer)
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertEqual(
+                archive.namelist(), ['e1_2016.html', 'e2_2018.html']
+            )
+            content = archive.read('e2_2018.html').decode('utf-8')
+        self.assertIn('\u00a365,000.00', content)
+
+
+class TestAggregate(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(30)
+        self.records = [
+            ('e%d' % index, rnd.choice(list(DEFAULT_DATA)),
+             rnd.randint(1, 250000))
+            for index in range(3000)
+        ]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertSameTotals(self, aggregate, other):
+        for year in DEFAULT_DATA:
+            summary = aggregate.years[year].summary()
+            other_summary = other.years[year].summary()
+            for key in ('count', 'gross_salary', 'tax_quantiles',
+                        'band_quantiles'):
+                self.assertEqual(summary[key], other_summary[key])
+            for key in ('total_tax', 'mean_effective_rate'):
+                self.assertAlmostEqual(
+                    summary[key], other_summary[key], places=6
+                )
+
+    def test_sketch_relative_accuracy(self):
+        rnd = random.Random(1)
+        values = sorted(rnd.uniform(-1000, 100000) for _ in range(5000))
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+        for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - expected), 0.01 * abs(expected)
+            )
+        self.assertEqual(sketch.quantile(0), values[0])
+        self.assertEqual(sketch.quantile(1), values[-1])
+
+    def test_sketch_merge_different_accuracy(self):
+        with self.assertRaises(ValueError):
+            QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+    def test_totals_match_calculator(self):
+        aggregate = PopulationAggregate(DEFAULT_DATA).add_records(
+            self.records
+        )
+        for year in DEFAULT_DATA:
+            calculator = TaxCalculator(DEFAULT_DATA[year])
+            salaries = [record[2] for record in self.records
+                        if record[1] == year]
+            summary = aggregate.summary()[year]
+            self.assertEqual(summary['count'], len(salaries))
+            self.assertEqual(summary['gross_salary'], sum(salaries))
+            self.assertAlmostEqual(
+                summary['total_tax'],
+                sum(calculator.compute(salary)[TaxCalculator.TOTAL_TAX]
+                    for salary in salaries),
+                places=6
+            )
+            self.assertAlmostEqual(
+                sum(summary['band_deductions'].values()),
+                summary['total_tax'], places=6
+            )
+
+    def test_merge_matches_single_pass(self):
+        whole = PopulationAggregate(DEFAULT_DATA).add_records(self.records)
+        merged = PopulationAggregate(DEFAULT_DATA).add_records(
+            self.records[:1000]
+        )
+        merged.merge(
+            PopulationAggregate(DEFAULT_DATA).add_records(self.records[1000:])
+        )
+        self.assertSameTotals(merged, whole)
+
+    def test_merge_leaves_other_untouched(self):
+        aggregate = PopulationAggregate(DEFAULT_DATA)
+        other = PopulationAggregate(DEFAULT_DATA)
+        other.add(2018, 30000)
+        aggregate.merge(other)
+        aggregate.add(2018, 40000)
+        self.assertEqual(aggregate.years['2018'].count, 2)
+        self.assertEqual(other.years['2018'].count, 1)
+
+    def test_merge_different_accuracy(self):
+        other = PopulationAggregate(DEFAULT_DATA, relative_accuracy=0.05)
+        other.add(2018, 30000)
+        with self.assertRaises(ValueError):
+            PopulationAggregate(DEFAULT_DATA).merge(other)
+
+    def test_aggregate_files_in_processes(self):
+        paths = []
+        for index in range(3):
+            path = os.path.join(self.tmp_dir.name, 'shard%d.csv' % index)
+            write_records(path, self.records[index::3])
+            paths.append(path)
+
+        whole = PopulationAggregate(DEFAULT_DATA).add_records(self.records)
+        self.assertSameTotals(
+            aggregate_files(paths, DEFAULT_DATA, processes=2), whole
+        )
+        self.assertSameTotals(
+            aggregate_files(paths, DEFAULT_DATA, processes=1), whole
+        )
+
+
+class TestTaxRules(unittest.TestCase):
+    def setUp(self):
+        bands = []
+        for band in IncomeTaxYearData.BANDS:
+            if DEFAULT_DATA['2018'][band]:
+                bands.append(dict(DEFAULT_DATA['2018'][band], name=band))
+        self.rules = {
+            '2018': {
+                'personal_allowance': 11850,
+                'jurisdictions': {'default': {'bands': bands}},
+            }
+        }
+
+    def test_compile_matches_year_data(self):
+        schedule = compile_rules(self.rules, 2018, 'default')
+        reference = TaxSchedule.from_year_data(DEFAULT_DATA['2018'])
+        self.assertEqual(schedule.bands, reference.bands)
+        self.assertEqual(schedule.personal_allowance, 11850)
+        self.assertIsNone(schedule.taper_threshold)
+
+    def test_compile_unknown_jurisdiction(self):
+        with self.assertRaises(ValueError) as cm:
+            compile_rules(self.rules, 2018, 'wales')
+        msg = ("Rules for wales are not available in 2018. Rules are "
+               "available for the following jurisdictions: default")
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_compile_band_after_unlimited_band(self):
+        bands = self.rules['2018']['jurisdictions']['default']['bands']
+        bands.append({'name': 'extra_rate', 'rate': 50, 'range_start': 0,
+                      'range_end': None})
+        with self.assertRaises(ValueError) as cm:
+            compile_rules(self.rules, 2018, 'default')
+        msg = "The extra_rate band comes after a band with no upper limit"
+        self.assertEqual(cm.exception.args[0], msg)
+
+    def test_jurisdictions(self):
+        rules = TaxRules()
+        self.assertEqual(rules.jurisdictions(2018), ['rest_of_uk', 'scotland'])
+        self.assertIs(
+            rules.get_schedule(2018, 'scotland'),
+            rules.get_schedule('2018', 'scotland')
+        )
+
+    def test_scotland_matches_reference_below_taper(self):
+        calculator = TaxRules().get_calculator(2018, 'scotland')
+        year_data = dict(DEFAULT_DATA['2018'])
+        year_data['higher_rate'] = dict(year_data['higher_rate'], rate=41)
+        reference = TaxCalculator(year_data)
+        for gross_salary in (0, 11850, 30000, 60000, 100000):
+            self.assertEqual(
+                list(calculator.compute(gross_salary)),
+                list(reference.compute(gross_salary))
+            )
+
+    def test_allowance_taper(self):
+        calculator = TaxRules().get_calculator(2018, 'rest_of_uk')
+        calculator.compute(100000)
+        self.assertEqual(calculator.taxable_income, 100000 - 11850)
+        calculator.compute(110001)
+        self.assertEqual(calculator.taxable_income, 110001 - (11850 - 5000))
+        calculator.compute(123700)
+        self.assertEqual(calculator.taxable_income, 123700)
+        calculator.compute(200000)
+        self.assertEqual(calculator.taxable_income, 200000)
+        # Band widths follow TaxBand, range_end - range_start
+        self.assertEqual(calculator.band_amount('additional_rate'), 50001)
+        self.assertEqual(
+            calculator.band_deduction('additional_rate'), 22500.45
+        )
+
+    def test_breakdown_of_new_band(self):
+        calculator = TaxRules().get_calculator(2018, 'rest_of_uk')
+        breakdown = calculator.get_breakdown(110000, GBP)
+        self.assertIn('Personal Allowance: \u00a36,850.00\n', breakdown)
+        self.assertIn(
+            'Additional Rate: \u00a350,001.00 @ 45% = \u00a322,500.45\n',
+            calculator.get_breakdown(200000, GBP)
+        )
+
+
+def random_year_tax_data(rnd):
+    """Random valid tax data for a year, shaped like DEFAULT_DATA"""
+    year_tax_data = {'personal_allowance': rnd.randint(0, 20000)}
+    bands = [band for band in IncomeTaxYearData.BANDS if rnd.random() < 0.7]
+    if not bands:
+        bands = [rnd.choice(list(IncomeTaxYearData.BANDS))]
+
+    range_start = 0
+    for band in IncomeTaxYearData.BANDS:
+        if band not in bands:
+            year_tax_data[band] = None
+            continue
+        if band == bands[-1] and rnd.random() < 0.5:
+            range_end = None
+        else:
+            range_end = range_start + rnd.randint(1, 100000)
+        year_tax_data[band] = {
+            'rate': rnd.randint(0, 60),
+            'range_start': range_start,
+            'range_end': range_end,
+        }
+        if range_end is not None:
+            range_start = range_end + 1
+    return year_tax_data
+
+
+def random_salaries(rnd, year_tax_data, count):
+    """Random salaries, a part of them on and around the band thresholds"""
+    edges = [0, year_tax_data['personal_allowance']]
+    for band in IncomeTaxYearData.BANDS:
+        if year_tax_data[band] and year_tax_data[band]['range_end']:
+            edges.append(
+                year_tax_data['personal_allowance'] +
+                year_tax_data[band]['range_end']
+            )
+
+    salaries = []
+    for _ in range(count):
+        choice = rnd.random()
+        if choice < 0.3:
+            salaries.append(rnd.choice(edges) + rnd.randint(-2, 2))
+        elif choice < 0.4:
+            salaries.append(round(rnd.uniform(0, 300000), 2))
+        else:
+            salaries.append(rnd.randint(0, 400000))
+    return salaries
+
+
+def reference_records(year_tax_data, salaries):
+    """
+    Result records calculated with IncomeTaxYearData and TaxBand, the
+    reference every other engine must match
+    """
+    records = []
+    bands = [band for band in IncomeTaxYearData.BANDS if year_tax_data[band]]
+    for gross_salary in salaries:
+        year_data = IncomeTaxYearData(
+            year='fuzz', tax_data={'fuzz': year_tax_data},
+            gross_salary=gross_salary
+        )
+        tax_bands = [getattr(year_data, band) for band in bands]
+        records.append(
+            [year_data.taxable_income,
+             sum(tax_band.band_deduction for tax_band in tax_bands)] +
+            [tax_band.range_amount for tax_band in tax_bands] +
+            [tax_band.band_deduction for tax_band in tax_bands]
+        )
+    return records
+
+
+def _calculator_compute(year_tax_data, salaries):
+    calculator = TaxCalculator(year_tax_data)
+    return [list(calculator.compute(salary)) for salary in salaries]
+
+
+def _calculator_calculate(year_tax_data, salaries):
+    calculator = TaxCalculator(year_tax_data)
+    return [list(calculator.calculate(salary)) for salary in salaries]
+
+
+def _build_lookup_table(year_tax_data, salaries):
+    # Only the salaries in pence use the fallback
+    cap = max([salary for salary in salaries if isinstance(salary, int)] +
+              [0])
+    return TaxLookupTable(year_tax_data, cap=cap)
+
+
+def _lookup_table(table, salaries):
+    return [list(table.lookup(salary)) for salary in salaries]
+
+
+def _compiled_rules(year_tax_data, salaries):
+    bands = [
+        dict(year_tax_data[band], name=band)
+        for band in IncomeTaxYearData.BANDS if year_tax_data[band]
+    ]
+    rules = {'fuzz': {
+        'personal_allowance': year_tax_data['personal_allowance'],
+        'jurisdictions': {'fuzz': {'bands': bands}},
+    }}
+    calculator = TaxRules(rules).get_calculator('fuzz', 'fuzz')
+    return [list(calculator.compute(salary)) for salary in salaries]
+
+
+def _calculator_compute_into(year_tax_data, salaries):
+    out_array = array.array('d', bytes(8 * len(salaries)))
+    return list(TaxCalculator(year_tax_data).compute_into(salaries, out_array))
+
+
+def _compute_shared(year_tax_data, salaries):
+    with compute_shared(salaries, year_tax_data, processes=2) as results:
+        return list(results.total_tax)
+
+
+def _scenario_engine(year_tax_data, salaries):
+    return ScenarioEngine(year_tax_data, salaries).base_revenue
+
+
+def _population_aggregate(year_tax_data, salaries):
+    aggregate = PopulationAggregate({'fuzz': year_tax_data})
+    for salary in salaries:
+        aggregate.add('fuzz', salary)
+    return aggregate.years['fuzz'].total_tax
+
+
+class TestComputeShared(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(36)
+        self.salaries = [rnd.randint(0, 300000) for _ in range(5000)]
+        self.calculator = TaxCalculator(DEFAULT_DATA['2018'])
+
+    def test_results_match_calculator(self):
+        with compute_shared(self.salaries, DEFAULT_DATA['2018'],
+                            processes=2) as results:
+            self.assertEqual(len(results), len(self.salaries))
+            total_tax = results.total_tax
+            taxable_income = results.taxable_income
+            top_rate = results.band_deductions('top_rate')
+            for index, salary in enumerate(self.salaries):
+                self.calculator.compute(salary)
+                self.assertEqual(total_tax[index], self.calculator.total_tax)
+                self.assertEqual(
+                    taxable_income[index], self.calculator.taxable_income
+                )
+                self.assertEqual(
+                    top_rate[index],
+                    self.calculator.band_deduction('top_rate')
+                )
+            self.assertEqual(
+                list(results.record(10)),
+                list(self.calculator.compute(self.salaries[10]))
+            )
+
+    def test_close_frees_memory(self):
+        results = compute_shared([30000], DEFAULT_DATA['2016'], processes=1)
+        self.assertEqual(results.band_amounts('basic_rate')[0], 19000)
+        results.close()
+        self.assertIsNone(results.memory)
+        results.close()
+
+    def test_no_salaries(self):
+        with compute_shared([], DEFAULT_DATA['2016'], processes=1) as results:
+            self.assertEqual(len(results.total_tax), 0)
+
+
+class TestDifferential(unittest.TestCase):
+    """
+    Differential fuzz test pinning every engine to the IncomeTaxYearData
+    and TaxBand reference, on random year data and salaries. Each engine
+    declares the absolute tolerance it is held to, engines producing result
+    records are compared field by field. The throughput of every engine
+    relative to the reference is written to stderr.
+    """
+    schedules = 10
+    salaries_per_schedule = 600
+
+    # name: (tolerance, engine returning one result record per salary)
+    record_engines = {
+        'TaxCalculator.compute': (0, _calculator_compute),
+        'TaxCalculator.calculate': (0, _calculator_calculate),
+        'TaxLookupTable': (0, _lookup_table),
+        'compile_rules': (0, _compiled_rules),
+    }
+    # name: (tolerance, engine returning the total tax of each salary)
+    total_engines = {
+        'TaxCalculator.compute_into': (0, _calculator_compute_into),
+        'compute_shared': (0, _compute_shared),
+    }
+    # name: (relative tolerance, engine returning the total tax of all the
+    # salaries)
+    population_engines = {
+        'ScenarioEngine': (1e-9, _scenario_engine),
+        'PopulationAggregate': (1e-9, _population_aggregate),
+    }
+    # name: setup building, outside of the timing, what the engine is given
+    # instead of the year tax data
+    engine_setups = {
+        'TaxLookupTable': _build_lookup_table,
+    }
+
+    def test_engines_match_reference(self):
+        rnd = random.Random(33)
+        cases = []
+        for _ in range(self.schedules):
+            year_tax_data = random_year_tax_data(rnd)
+            cases.append((year_tax_data, random_salaries(
+                rnd, year_tax_data, self.salaries_per_schedule
+            )))
+
+        timings = {}
+
+        def timed(name, engine, year_tax_data, salaries):
+            setup = self.engine_setups.get(name)
+            if setup is not None:
+                year_tax_data = setup(year_tax_data, salaries)
+            start = time.perf_counter()
+            result = engine(year_tax_data, salaries)
+            timings[name] = (
+                timings.get(name, 0) + time.perf_counter() - start
+            )
+            return result
+
+        for year_tax_data, salaries in cases:
+            expected = timed(
+                'reference', reference_records, year_tax_data, salaries
+            )
+            expected_totals = [record[1] for record in expected]
+            expected_total = sum(expected_totals)
+
+            for name, (tolerance, engine) in self.record_engines.items():
+                records = timed(name, engine, year_tax_data, salaries)
+                self.assertEqual(len(records), len(expected), name)
+                for salary, record, expected_record in zip(
+                        salaries, records, expected):
+                    self.assertEqual(len(record), len(expected_record), name)
+                    for value, expected_value in zip(record, expected_record):
+                        self.assertLessEqual(
+                            abs(value - expected_value), tolerance,
+                            '%s differs for %s on %s' % (
+                                name, salary, year_tax_data
+                            )
+                        )
+
+            for name, (tolerance, engine) in self.total_engines.items():
+                totals = timed(name, engine, year_tax_data, salaries)
+                self.assertEqual(len(totals), len(expected_totals), name)
+                for salary, total, expected_value in zip(
+                        salaries, totals, expected_totals):
+                    self.assertLessEqual(
+                        abs(total - expected_value), tolerance,
+                        '%s differs for %s on %s' % (
+                            name, salary, year_tax_data
+                        )
+                    )
+
+            for name, (tolerance, engine) in self.population_engines.items():
+                total = timed(name, engine, year_tax_data, salaries)
+                self.assertLessEqual(
+                    abs(total - expected_total),
+                    tolerance * max(1, abs(expected_total)),
+                    '%s differs on %s' % (name, year_tax_data)
+                )
+
+        report = ['throughput against the reference:']
+        for name, elapsed in sorted(timings.items()):
+            report.append('  %-28s x%.1f' % (
+                name, timings['reference'] / elapsed
+            ))
+        sys.stderr.write('\n' + '\n'.join(report) + '\n')
+
+
 if __name__ == '__main__':
     unittest.main()